@@ -8,15 +8,26 @@ env_path = basedir / '.env'
 if env_path.exists():
     load_dotenv(env_path)
 
-from fastapi import FastAPI
+import asyncio
+import json
+import time
+from fastapi import FastAPI, HTTPException, Request, Response
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import StreamingResponse
+from starlette.concurrency import run_in_threadpool
 from pydantic import BaseModel
-from typing import List, Dict, Any
+from typing import List, Dict, Any, Optional, Tuple
 import uvicorn
-from langgraph_orchestrator import orchestrate
+from langgraph_orchestrator import orchestrate, get_pack_fallback_steps, batcher, prefetcher
+import traffic_capture
+import profiling
+import knowledge_packs
+import draft_jobs
+import model_router
 
 class OrchestrateRequest(BaseModel):
     message: str
+    pack: str = ''  # knowledge pack id; empty selects DEFAULT_PACK
 
 class EmailReplyRequest(BaseModel):
     emailText: str
@@ -41,50 +52,133 @@ async def health():
 
 
 @app.post("/orchestrate")
-async def post_orchestrate(req: OrchestrateRequest):
+async def post_orchestrate(req: OrchestrateRequest, request: Request):
     """Accepts {message: str} and returns structured guidance: {summary, steps:[{instruction,target_text}]}
 
     Example input:
-    {"message": "How do I register for classes?"}
+    {"message": "How do I register for classes?", "pack": "fau"}
     """
+    # Run in the threadpool so concurrent requests overlap (and can share batched upstream calls)
+    return await run_in_threadpool(_orchestrate, req, request)
+
+
+def _orchestrate(req: OrchestrateRequest, request: Request) -> Dict[str, Any]:
+    # Validate the pack here, off the event loop: a cold pack is compiled and read from disk
+    if req.pack:
+        try:
+            knowledge_packs.get_pack(req.pack)
+        except knowledge_packs.UnknownPackError:
+            raise HTTPException(status_code=400, detail=f"Unknown knowledge pack: {req.pack}")
+        except Exception as e:
+            print(f"[ERROR] Knowledge pack {req.pack} failed to load: {type(e).__name__}: {e}")
+            return get_pack_fallback_steps(req.message, req.pack)
     try:
         print(f"[DEBUG] Received orchestrate request: {req.message}")
-        # Use the orchestrator (LangGraph if available, otherwise OpenAI fallback)
-        result = orchestrate(req.message)
+        with profiling.profiled(request), \
+                traffic_capture.capture('/orchestrate', req.dict(), request.headers.get(traffic_capture.REPLAY_HEADER)) as trace:
+            # Use the orchestrator (LangGraph if available, otherwise OpenAI fallback)
+            result = orchestrate(req.message, req.pack or None)
+            if trace is not None:
+                trace['response'] = result
+            # Only callers with their own id: behind a proxy every student shares one address
+            client = request.headers.get('X-Client-Id')
+            if prefetcher is not None and client and not traffic_capture.replaying():
+                prefetcher.observe(client, req.pack or knowledge_packs.DEFAULT_PACK, req.message)
         print(f"[DEBUG] Orchestrate successful, returning result: {result}")
         return result
     except Exception as e:
         print(f"[ERROR] Orchestrate failed: {type(e).__name__}: {e}")
         import traceback
         print(f"[ERROR] Full traceback: {traceback.format_exc()}")
-        # Return a fallback response if orchestrator fails
-        return {
-            "summary": "Steps to register for classes at FAU",
-            "steps": [
-                {"instruction": "Go to the FAU Student Portal", "target_text": "Student Portal"},
-                {"instruction": "Click on 'Registration' or 'Student Services'", "target_text": "Registration"},
-                {"instruction": "Select 'Register for Classes'", "target_text": "Register for Classes"},
-                {"instruction": "Search and add your desired courses", "target_text": "Add Course"}
-            ]
-        }
+        # Return a fallback response for the requested pack if orchestrator fails
+        return get_pack_fallback_steps(req.message, req.pack or None)
 
 
 @app.post("/draft-reply")
-async def draft_email_reply(req: EmailReplyRequest):
+async def draft_email_reply(req: EmailReplyRequest, request: Request):
     """Generate AI-powered email reply based on selected email text and user instructions"""
+    # The upstream call blocks for up to 60 s; keep it off the event loop
+    return await run_in_threadpool(_profiled_draft, req, request)
+
+
+@app.post("/draft-reply/jobs", status_code=202)
+async def submit_draft_job(req: EmailReplyRequest, request: Request):
+    """Queue an email reply draft and return {job_id, status} immediately.
+
+    Poll GET /draft-reply/jobs/{job_id} (or subscribe to .../events) for the reply.
+    Resubmitting the same emailText and userInstructions returns the existing job.
+    An admin's X-Profile-Request tag profiles the job's run.
+    """
+    payload = (req, profiling.profile_tag(request))
     try:
-        import requests
-        
-        FAU_API_URL = os.environ.get('FAU_API_URL', 'https://chat.hpc.fau.edu/openai/chat/completions')
-        FAU_API_KEY = os.environ.get('FAU_API_KEY', 'sk-6513a2c196d74796a79bc6c32cd426d2')
-        FAU_MODEL = os.environ.get('FAU_MODEL', 'gemini-2.0-flash-lite')
-        
-        # Build prompt with user instructions
-        instructions_part = ''
-        if req.userInstructions:
-            instructions_part = f"\n\nUser's additional instructions: {req.userInstructions}"
-        
-        system_prompt = """You are a professional email assistant. Help draft email replies by gathering necessary information first.
+        job, created = await draft_store.submit(draft_jobs.job_key(req.emailText, req.userInstructions), payload)
+    except draft_jobs.QueueFullError as e:
+        raise HTTPException(status_code=503, detail=str(e))
+    print(f"[DEBUG] Draft job {job.id} {'queued' if created else 'reused'} ({job.status})")
+    return job.to_dict()
+
+
+@app.get("/draft-reply/jobs/{job_id}")
+async def get_draft_job(job_id: str, wait: float = 0):
+    """Return {job_id, status, reply?}. ?wait=N long-polls up to N seconds (max 30) for the job to finish."""
+    job = draft_store.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Unknown or expired job")
+    await draft_store.wait(job, min(max(wait, 0), 30))
+    return job.to_dict()
+
+
+@app.get("/draft-reply/jobs/{job_id}/events")
+async def draft_job_events(job_id: str):
+    """Server-sent events: the job's current state, a heartbeat every 15 s, then the final result."""
+    job = draft_store.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Unknown or expired job")
+
+    async def stream():
+        yield f"data: {json.dumps(job.to_dict())}\n\n"
+        while job.status in (draft_jobs.QUEUED, draft_jobs.RUNNING):
+            await draft_store.wait(job, 15)
+            yield f"data: {json.dumps(job.to_dict())}\n\n"
+
+    return StreamingResponse(stream(), media_type='text/event-stream')
+
+
+def _profiled_draft(req: EmailReplyRequest, request: Request) -> Dict[str, Any]:
+    with profiling.profiled(request):
+        return _traced_draft(req, request.headers.get(traffic_capture.REPLAY_HEADER))
+
+
+def _traced_draft(req: EmailReplyRequest, replay_id: str = None, fallback: bool = True) -> Dict[str, Any]:
+    with traffic_capture.capture('/draft-reply', req.dict(), replay_id) as trace:
+        result = _draft_email_reply(req) if fallback else _generate_email_reply(req)
+        if trace is not None:
+            trace['response'] = result
+        return result
+
+
+def _run_draft_job(payload: Tuple[EmailReplyRequest, Optional[str]]) -> Dict[str, Any]:
+    req, profile_tag = payload
+    with profiling.profiled_as(profile_tag, '/draft-reply/jobs'):
+        # No canned fallback: a failed draft must end up FAILED so resubmitting retries it
+        return _traced_draft(req, fallback=False)
+
+
+# Process-wide draft job store; its worker threads start on the first job
+draft_store = draft_jobs.DraftJobStore(_run_draft_job)
+
+
+def _generate_email_reply(req: EmailReplyRequest) -> Dict[str, Any]:
+    """Draft a reply with the upstream LLM. Raises if the call fails or returns nothing usable."""
+    FAU_API_URL = os.environ.get('FAU_API_URL', 'https://chat.hpc.fau.edu/openai/chat/completions')
+    FAU_API_KEY = os.environ.get('FAU_API_KEY', 'sk-6513a2c196d74796a79bc6c32cd426d2')
+    
+    # Build prompt with user instructions
+    instructions_part = ''
+    if req.userInstructions:
+        instructions_part = f"\n\nUser's additional instructions: {req.userInstructions}"
+    
+    system_prompt = """You are a professional email assistant. Help draft email replies by gathering necessary information first.
 
 Rules:
 1. Remember all information the user has already provided in this conversation
@@ -99,8 +193,8 @@ Generate the final email only when you have:
 - Clear understanding of the request
 
 Format emails with proper spacing and professional structure."""
-        
-        user_prompt = f"""I need help drafting a professional email reply to the following email:{instructions_part}
+    
+    user_prompt = f"""I need help drafting a professional email reply to the following email:{instructions_part}
 
 Original Email:
 ---
@@ -108,48 +202,65 @@ Original Email:
 ---
 
 Please help me create an appropriate response. Ask me for any information you need to draft a complete reply without placeholder text."""
-        
-        headers = {
-            "Content-Type": "application/json",
-            "Authorization": f"Bearer {FAU_API_KEY}",
-        }
-        
-        # Get recent chat messages for context
-        messages = [{"role": "system", "content": system_prompt}]
-        
-        # Add conversation history for context (last 6 messages)
-        try:
-            import json as json_lib
-            chat_history = json_lib.loads(req.userInstructions) if req.userInstructions.startswith('[') else []
-            if isinstance(chat_history, list):
-                for msg in chat_history[-6:]:
-                    if isinstance(msg, dict) and 'from' in msg and 'text' in msg:
-                        role = 'user' if msg['from'] == 'user' else 'assistant'
-                        messages.append({"role": role, "content": msg['text']})
-        except:
-            pass
-        
-        # Add current user message
-        messages.append({"role": "user", "content": user_prompt})
-        
-        payload = {
-            "model": FAU_MODEL,
-            "messages": messages
-        }
-        
-        print(f"[DEBUG] Generating email reply...")
-        resp = requests.post(FAU_API_URL, json=payload, headers=headers, timeout=60)
+    
+    headers = {
+        "Content-Type": "application/json",
+        "Authorization": f"Bearer {FAU_API_KEY}",
+    }
+    
+    # Get recent chat messages for context
+    messages = [{"role": "system", "content": system_prompt}]
+    
+    # Add conversation history for context (last 6 messages)
+    history_size = 0
+    try:
+        import json as json_lib
+        chat_history = json_lib.loads(req.userInstructions) if req.userInstructions.startswith('[') else []
+        if isinstance(chat_history, list):
+            history_size = len(chat_history)
+            for msg in chat_history[-6:]:
+                if isinstance(msg, dict) and 'from' in msg and 'text' in msg:
+                    role = 'user' if msg['from'] == 'user' else 'assistant'
+                    messages.append({"role": role, "content": msg['text']})
+    except:
+        pass
+    
+    # Add current user message
+    messages.append({"role": "user", "content": user_prompt})
+    
+    # Pick the fastest model that meets the quality floor for this kind of email
+    route = model_router.choose('draft', model_router.classify_draft(req.emailText, history_size))
+    payload = {
+        "model": route.begin(),
+        "messages": messages
+    }
+    
+    print(f"[DEBUG] Generating email reply...")
+    start = time.perf_counter()
+    try:
+        resp = traffic_capture.upstream_post(FAU_API_URL, json=payload, headers=headers, timeout=60)
         resp.raise_for_status()
-        result = resp.json()
+        with traffic_capture.stage('parse'):
+            result = resp.json()
         
         # Extract the response content from OpenAI format
-        if 'choices' in result and len(result['choices']) > 0:
-            reply = result['choices'][0]['message']['content']
-            print(f"[DEBUG] Email reply generated successfully")
-            return {"reply": reply.strip()}
-        else:
+        if 'choices' not in result or len(result['choices']) == 0:
             raise RuntimeError("Invalid response format from LLM")
-        
+        reply = result['choices'][0]['message']['content']
+    except Exception:
+        route.fail((time.perf_counter() - start) * 1000)
+        raise
+    
+    print(f"[DEBUG] Email reply generated successfully")
+    route.complete((time.perf_counter() - start) * 1000)
+    route.validate(bool(reply.strip()))
+    return {"reply": reply.strip()}
+
+
+def _draft_email_reply(req: EmailReplyRequest) -> Dict[str, Any]:
+    """Synchronous /draft-reply: a canned acknowledgement stands in if drafting fails."""
+    try:
+        return _generate_email_reply(req)
     except Exception as e:
         print(f"[ERROR] Email reply failed: {e}")
         import traceback
@@ -157,5 +268,51 @@ Please help me create an appropriate response. Ask me for any information you ne
         return {"reply": "Thank you for your email. I will review this and get back to you soon."}
 
 
+@app.get("/admin/stats")
+async def admin_stats(request: Request):
+    """Tuning counters: orchestrate batching and prefetch, draft jobs, model routing, knowledge pack cache."""
+    profiling.require_admin(request)
+    return {
+        "batching": batcher.stats(),
+        "prefetch": prefetcher.stats() if prefetcher else {"enabled": False, "counters": {}},
+        "draft_jobs": draft_store.stats(),
+        "routing": model_router.stats(),
+        "knowledge_packs": knowledge_packs.cache_info(),
+    }
+
+
+@app.post("/admin/profile/sample")
+async def profile_sample(request: Request, seconds: float = 10, requests: int = 0, interval_ms: float = 5, format: str = 'speedscope'):
+    """Sample all backend stacks for `seconds`, or until `requests` requests finish, and return a profile file.
+
+    format: speedscope (open at https://www.speedscope.app), folded (flamegraph.pl input) or svg
+    """
+    profiling.require_admin(request)
+    seconds = min(max(seconds, 0.1), profiling.PROFILING_MAX_SECONDS)
+    session = profiling.start_sampling(max(interval_ms, 1) / 1000)
+    try:
+        deadline = time.time() + seconds
+        while time.time() < deadline and not (requests and session.requests_done >= requests):
+            await asyncio.sleep(0.05)
+    finally:
+        profiling.stop_sampling()
+    body, media_type, filename = profiling.export(session, format)
+    return Response(body, media_type=media_type, headers={"Content-Disposition": f'attachment; filename="{filename}"'})
+
+
+@app.get("/admin/profile/requests/{tag}")
+async def profile_request(tag: str, request: Request, format: str = 'text'):
+    """Return the cProfile stats recorded for a request sent with X-Profile-Request: <tag>.
+
+    format: text (top functions by cumulative time) or prof (binary pstats dump)
+    """
+    profiling.require_admin(request)
+    if format == 'prof':
+        return Response(profiling.dump_request_profile(tag), media_type='application/octet-stream',
+                        headers={"Content-Disposition": f'attachment; filename="{tag}.prof"'})
+    entry = profiling.get_request_profile(tag)
+    return Response(f"{entry['path']} took {entry['elapsed_ms']} ms\n\n{entry['stats_text']}", media_type='text/plain')
+
+
 if __name__ == '__main__':
     uvicorn.run('app:app', host='0.0.0.0', port=int(os.environ.get('PORT', 8000)), reload=True)
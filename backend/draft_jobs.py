@@ -0,0 +1,144 @@
+"""
+Asynchronous job mode for /draft-reply.
+
+A draft can take up to a minute upstream, which is longer than the extension's
+service worker is guaranteed to stay alive. With the job API the POST returns a
+job id immediately, the draft runs on a bounded worker pool, and clients poll
+(optionally long-polling with ?wait=) or subscribe to server-sent events for
+the result.
+
+Finished jobs stay in memory for DRAFT_JOB_TTL seconds. Submitting the same
+email text and instructions while a job is queued, running or still cached
+returns that job instead of starting another, so a client that lost its
+connection can simply resubmit and pick up the result.
+"""
+from typing import Any, Callable, Dict, Optional, Tuple
+import asyncio
+import collections
+import concurrent.futures
+import hashlib
+import os
+import threading
+import time
+import uuid
+
+DRAFT_WORKERS = int(os.environ.get('DRAFT_WORKERS', 4))
+DRAFT_MAX_PENDING = int(os.environ.get('DRAFT_MAX_PENDING', 100))
+DRAFT_JOB_TTL = float(os.environ.get('DRAFT_JOB_TTL', 600))
+
+QUEUED, RUNNING, DONE, FAILED = 'queued', 'running', 'done', 'failed'
+
+
+class QueueFullError(RuntimeError):
+    """Raised when DRAFT_MAX_PENDING jobs are already waiting for a worker."""
+
+
+class DraftJob:
+    def __init__(self, key: str):
+        self.id = uuid.uuid4().hex
+        self.key = key
+        self.status = QUEUED
+        self.created = time.time()
+        self.started: Optional[float] = None
+        self.finished: Optional[float] = None
+        self.result: Optional[Dict[str, Any]] = None
+        self.error: Optional[str] = None
+        self.future: Optional[asyncio.Future] = None
+
+    def expired(self, now: float) -> bool:
+        return self.finished is not None and now - self.finished > DRAFT_JOB_TTL
+
+    def to_dict(self) -> Dict[str, Any]:
+        data: Dict[str, Any] = {"job_id": self.id, "status": self.status}
+        if self.result is not None:
+            data.update(self.result)
+        if self.error is not None:
+            data["error"] = self.error
+        if self.finished is not None:
+            data["duration_ms"] = round((self.finished - self.created) * 1000, 1)
+        return data
+
+
+def job_key(email_text: str, user_instructions: str) -> str:
+    return hashlib.sha256(f"{email_text}\0{user_instructions}".encode('utf-8')).hexdigest()
+
+
+class DraftJobStore:
+    """Runs draft jobs on a bounded thread pool and keeps their results for a TTL."""
+
+    def __init__(self, run: Callable[[Any], Dict[str, Any]], workers: int = DRAFT_WORKERS,
+                 max_pending: int = DRAFT_MAX_PENDING):
+        self.run = run
+        self.workers = workers
+        self.max_pending = max_pending
+        self._executor = concurrent.futures.ThreadPoolExecutor(max_workers=workers, thread_name_prefix='draft-job')
+        self._jobs: Dict[str, DraftJob] = {}
+        self._by_key: Dict[str, DraftJob] = {}
+        self._lock = threading.Lock()
+        self._counters: "collections.Counter[str]" = collections.Counter()
+
+    async def submit(self, key: str, payload: Any) -> Tuple[DraftJob, bool]:
+        """Start a job for payload, or return the live job with the same key. Returns (job, created)."""
+        loop = asyncio.get_running_loop()
+        with self._lock:
+            self._purge(time.time())
+            existing = self._by_key.get(key)
+            if existing is not None and existing.status != FAILED:
+                self._counters['deduplicated'] += 1
+                return existing, False
+            pending = sum(1 for j in self._jobs.values() if j.status == QUEUED)
+            if pending >= self.max_pending:
+                self._counters['rejected'] += 1
+                raise QueueFullError(f"{pending} draft jobs already queued")
+            job = DraftJob(key)
+            self._jobs[job.id] = job
+            self._by_key[key] = job
+            self._counters['submitted'] += 1
+        job.future = loop.run_in_executor(self._executor, self._execute, job, payload)
+        return job, True
+
+    def _execute(self, job: DraftJob, payload: Any) -> None:
+        job.status = RUNNING
+        job.started = time.time()
+        try:
+            job.result = self.run(payload)
+            job.status = DONE
+        except Exception as e:
+            print(f"[ERROR] Draft job {job.id} failed: {e}")
+            job.error = str(e)
+            job.status = FAILED
+        finally:
+            job.finished = time.time()
+            with self._lock:
+                self._counters[job.status] += 1
+
+    def get(self, job_id: str) -> Optional[DraftJob]:
+        with self._lock:
+            self._purge(time.time())
+            return self._jobs.get(job_id)
+
+    async def wait(self, job: DraftJob, timeout: float) -> DraftJob:
+        """Wait up to timeout seconds for the job to finish; returns it either way."""
+        if job.future is not None and timeout > 0 and not job.future.done():
+            try:
+                await asyncio.wait_for(asyncio.shield(job.future), timeout)
+            except asyncio.TimeoutError:
+                pass
+        return job
+
+    def _purge(self, now: float) -> None:
+        for job_id in [jid for jid, j in self._jobs.items() if j.expired(now)]:
+            job = self._jobs.pop(job_id)
+            if self._by_key.get(job.key) is job:
+                del self._by_key[job.key]
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            statuses = collections.Counter(j.status for j in self._jobs.values())
+            return {
+                "workers": self.workers,
+                "max_pending": self.max_pending,
+                "ttl_seconds": DRAFT_JOB_TTL,
+                "jobs": dict(statuses),
+                "counters": dict(self._counters),
+            }
@@ -0,0 +1,65 @@
+"""
+Local stand-in for the OpenAI-compatible upstream, used by the load-test scripts.
+
+    with FakeUpstream(reply) as upstream:
+        langgraph_orchestrator.FAU_API_URL = upstream.url
+        ...
+    upstream.calls  # every request payload received
+
+reply(payload) returns the assistant message content, or raises to make the
+call fail with a 500. delay adds upstream latency in seconds.
+"""
+from typing import Any, Callable, Dict, List
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import json
+import threading
+import time
+
+
+class FakeUpstream:
+    def __init__(self, reply: Callable[[Dict[str, Any]], str], delay: float = 0.0):
+        self.reply = reply
+        self.delay = delay
+        self.calls: List[Dict[str, Any]] = []
+        self._lock = threading.Lock()
+        upstream = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_POST(self):
+                payload = json.loads(self.rfile.read(int(self.headers['Content-Length'])))
+                with upstream._lock:
+                    upstream.calls.append(payload)
+                time.sleep(upstream.delay)
+                try:
+                    status = 200
+                    body = {"choices": [{"message": {"role": "assistant", "content": upstream.reply(payload)}}]}
+                except Exception as e:
+                    status, body = 500, {"error": str(e)}
+                data = json.dumps(body).encode('utf-8')
+                self.send_response(status)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def log_message(self, *args):
+                pass
+
+        self._server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        self.url = f"http://127.0.0.1:{self._server.server_address[1]}/chat/completions"
+
+    def __enter__(self) -> "FakeUpstream":
+        threading.Thread(target=self._server.serve_forever, daemon=True).start()
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self._server.shutdown()
+        self._server.server_close()
+
+
+def steps_json(summary: str, count: int = 4) -> str:
+    """A well-formed orchestrate answer with `count` steps."""
+    return json.dumps({
+        "summary": summary,
+        "steps": [{"instruction": f"Click 'Step {i}'", "target_text": f"Step {i}"} for i in range(1, count + 1)],
+    })
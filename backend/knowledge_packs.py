@@ -0,0 +1,228 @@
+"""
+Knowledge packs: per-college / per-department content for the orchestrator.
+
+A pack is a JSON source file in packs/<pack_id>.json holding prompt fragments,
+the knowledge-base URL map, fallback guides and UI vocabulary. On first use
+each pack is compiled into a pickle under packs/.compiled/ (the system prompt
+assembled, keywords and vocabulary pre-lowercased) and recompiled only when
+the source changes. Compiled packs are loaded lazily per request and held in an
+LRU bounded by entry count and approximate size, so adding tenants costs
+neither startup time nor resident memory until they are used.
+
+Precompile every pack ahead of a deploy with:
+    python knowledge_packs.py
+"""
+from typing import Any, Dict, List, Optional
+import collections
+import json
+import os
+import pathlib
+import pickle
+import re
+import sys
+import tempfile
+import threading
+
+PACKS_DIR = pathlib.Path(os.environ.get('KNOWLEDGE_PACKS_DIR', pathlib.Path(__file__).resolve().parent / 'packs'))
+COMPILED_DIR = PACKS_DIR / '.compiled'
+DEFAULT_PACK = os.environ.get('DEFAULT_PACK', 'fau')
+PACK_CACHE_MAX_ENTRIES = int(os.environ.get('PACK_CACHE_MAX_ENTRIES', 16))
+PACK_CACHE_MAX_BYTES = int(os.environ.get('PACK_CACHE_MAX_BYTES', 32 * 1024 * 1024))
+
+# Bump when the compiled layout changes so stale pickles are rebuilt
+COMPILED_FORMAT = 1
+
+_PACK_ID_RE = re.compile(r'^[a-z0-9][a-z0-9_-]{0,63}$')
+
+SYSTEM_PROMPT_TEMPLATE = """{intro}
+
+IMPORTANT: You MUST respond with ONLY valid JSON in this exact format:
+{{
+  "summary": "Brief description of the task",
+  "steps": [
+    {{"instruction": "Detailed step instruction", "target_text": "UI Element Text"}},
+    {{"instruction": "Next step instruction", "target_text": "Button/Link Text"}}
+  ]
+}}
+
+{knowledge_title}:
+{knowledge}
+
+TARGET_TEXT RULES:
+- Should be the exact text visible on buttons, links, or menu items
+- Examples: {target_text_examples}
+- Keep it short and specific to what appears on screen
+
+INSTRUCTION RULES:
+{instruction_rules}
+
+IMPORTANT: Always provide at least 3-4 actionable steps. Never return empty steps. If you don't have specific information about a service, provide general navigation steps to find it {general_navigation}.
+
+DO NOT include any explanation, markdown, or text outside the JSON object."""
+
+
+class UnknownPackError(KeyError):
+    """Raised when a pack id is malformed or has no source file."""
+
+
+class KnowledgePack:
+    """A compiled knowledge pack. Build with load_pack()/get_pack(), not directly."""
+
+    def __init__(self, data: Dict[str, Any], size: int):
+        self.id: str = data['id']
+        self.name: str = data['name']
+        self.system_prompt: str = data['system_prompt']
+        self.ui_patterns: List[str] = data['ui_patterns']
+        self.ui_patterns_lower: List[str] = data['ui_patterns_lower']
+        self.stopwords: frozenset = frozenset(data['stopwords'])
+        self.fallback_guides: List[Dict[str, Any]] = data['fallback_guides']
+        self.default_guide: Dict[str, Any] = data['default_guide']
+        self.knowledge_base: Dict[str, Any] = data['knowledge_base']
+        # Approximate in-memory footprint, used for the LRU byte budget
+        self.size = size
+
+    def fallback_guide(self, user_query: str) -> Dict[str, Any]:
+        """Return a copy of the first fallback guide whose keywords match the query."""
+        query_lower = user_query.lower()
+        for guide in self.fallback_guides:
+            if any(k in query_lower for k in guide['keywords']):
+                return {"summary": guide['summary'], "steps": [dict(s) for s in guide['steps']]}
+        return {
+            "summary": self.default_guide['summary'].replace('{query}', user_query),
+            "steps": [dict(s) for s in self.default_guide['steps']],
+        }
+
+
+def _source_path(pack_id: str) -> pathlib.Path:
+    if not _PACK_ID_RE.match(pack_id):
+        raise UnknownPackError(pack_id)
+    path = PACKS_DIR / f"{pack_id}.json"
+    if not path.exists():
+        raise UnknownPackError(pack_id)
+    return path
+
+
+def available_packs() -> List[str]:
+    return sorted(p.stem for p in PACKS_DIR.glob('*.json') if _PACK_ID_RE.match(p.stem))
+
+
+def compile_source(source: Dict[str, Any]) -> Dict[str, Any]:
+    """Turn a pack source document into the compiled (pickled) representation."""
+    prompt = source['prompt']
+    vocabulary = source.get('ui_vocabulary', {})
+    system_prompt = SYSTEM_PROMPT_TEMPLATE.format(
+        intro=prompt['intro'],
+        knowledge_title=prompt['knowledge_title'],
+        knowledge='\n'.join(f"- {line}" for line in prompt['knowledge']),
+        target_text_examples=', '.join(f'"{t}"' for t in prompt['target_text_examples']),
+        instruction_rules='\n'.join(f"- {line}" for line in prompt['instruction_rules']),
+        general_navigation=prompt['general_navigation'],
+    )
+    patterns = list(vocabulary.get('patterns', []))
+    return {
+        "format": COMPILED_FORMAT,
+        "id": source['id'],
+        "name": source['name'],
+        "system_prompt": system_prompt,
+        "ui_patterns": patterns,
+        "ui_patterns_lower": [p.lower() for p in patterns],
+        "stopwords": [w.lower() for w in vocabulary.get('stopwords', [])],
+        "fallback_guides": [
+            {"keywords": [k.lower() for k in g['keywords']], "summary": g['summary'], "steps": g['steps']}
+            for g in source.get('fallback_guides', [])
+        ],
+        "default_guide": source['default_guide'],
+        "knowledge_base": source.get('knowledge_base', {}),
+    }
+
+
+def compile_pack(pack_id: str, force: bool = False) -> pathlib.Path:
+    """Compile packs/<pack_id>.json if the compiled file is missing or stale. Returns the compiled path."""
+    source_path = _source_path(pack_id)
+    compiled_path = COMPILED_DIR / f"{pack_id}.pickle"
+    if not force and compiled_path.exists() and compiled_path.stat().st_mtime >= source_path.stat().st_mtime:
+        return compiled_path
+
+    with open(source_path, encoding='utf-8') as fh:
+        source = json.load(fh)
+    if source.get('id') != pack_id:
+        raise ValueError(f"Pack file {source_path.name} declares id {source.get('id')!r}")
+    compiled = compile_source(source)
+
+    COMPILED_DIR.mkdir(parents=True, exist_ok=True)
+    # Unique temp file per writer: other threads or workers may be compiling the same pack
+    with tempfile.NamedTemporaryFile(dir=COMPILED_DIR, prefix=f"{pack_id}.", suffix='.tmp', delete=False) as fh:
+        pickle.dump(compiled, fh, protocol=pickle.HIGHEST_PROTOCOL)
+    try:
+        os.replace(fh.name, compiled_path)
+    except OSError:
+        os.unlink(fh.name)
+        raise
+    print(f"[DEBUG] Compiled knowledge pack {pack_id} -> {compiled_path}")
+    return compiled_path
+
+
+def load_pack(pack_id: str) -> KnowledgePack:
+    """Load a pack from its compiled file, compiling it first if needed (bypasses the cache)."""
+    compiled_path = compile_pack(pack_id)
+    with open(compiled_path, 'rb') as fh:
+        raw = fh.read()
+    data = pickle.loads(raw)
+    if data.get('format') != COMPILED_FORMAT:
+        compiled_path = compile_pack(pack_id, force=True)
+        with open(compiled_path, 'rb') as fh:
+            raw = fh.read()
+        data = pickle.loads(raw)
+    # Unpickled strings and lists take roughly 3x their serialized size
+    return KnowledgePack(data, size=len(raw) * 3)
+
+
+_cache: "collections.OrderedDict[str, KnowledgePack]" = collections.OrderedDict()
+_cache_bytes = 0
+_cache_lock = threading.Lock()
+# One lock per pack id so concurrent cold loads of a pack compile and read it once
+_load_locks: Dict[str, threading.Lock] = {}
+
+
+def get_pack(pack_id: Optional[str] = None) -> KnowledgePack:
+    """Return the compiled pack for pack_id (default: DEFAULT_PACK) from the LRU, loading it on a miss."""
+    global _cache_bytes
+    pack_id = pack_id or DEFAULT_PACK
+    with _cache_lock:
+        pack = _cache.get(pack_id)
+        if pack is not None:
+            _cache.move_to_end(pack_id)
+            return pack
+        load_lock = _load_locks.setdefault(pack_id, threading.Lock())
+
+    with load_lock:
+        with _cache_lock:
+            pack = _cache.get(pack_id)
+        if pack is not None:
+            return pack
+        try:
+            pack = load_pack(pack_id)
+        except Exception:
+            with _cache_lock:
+                # Don't keep a lock around for every unknown id a client sends
+                _load_locks.pop(pack_id, None)
+            raise
+        with _cache_lock:
+            _cache[pack_id] = pack
+            _cache_bytes += pack.size
+            while len(_cache) > 1 and (len(_cache) > PACK_CACHE_MAX_ENTRIES or _cache_bytes > PACK_CACHE_MAX_BYTES):
+                evicted_id, evicted = _cache.popitem(last=False)
+                _cache_bytes -= evicted.size
+                print(f"[DEBUG] Evicted knowledge pack {evicted_id} from cache")
+            return _cache.get(pack_id, pack)
+
+
+def cache_info() -> Dict[str, Any]:
+    with _cache_lock:
+        return {"packs": list(_cache), "bytes": _cache_bytes,
+                "max_entries": PACK_CACHE_MAX_ENTRIES, "max_bytes": PACK_CACHE_MAX_BYTES}
+
+
+if __name__ == "__main__":
+    for pid in sys.argv[1:] or available_packs():
+        compile_pack(pid, force=True)
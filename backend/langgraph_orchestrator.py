@@ -5,11 +5,17 @@ your school's OpenAI-compatible API to produce a JSON array of steps.
 
 Each step should be a dict: {"instruction": "Click the Next button", "target_text": "Next"}
 """
-from typing import List, Dict, Any
+from typing import List, Dict, Any, Optional
 import os
 import json
-import requests
+import time
 from dotenv import load_dotenv
+import traffic_capture
+import knowledge_packs
+import micro_batching
+import prefetch
+import model_router
+from knowledge_packs import KnowledgePack
 
 # Load environment variables from .env file
 load_dotenv()
@@ -29,62 +35,61 @@ print(f"[DEBUG] FAU_API_URL: {FAU_API_URL}")
 print(f"[DEBUG] FAU_API_KEY: {FAU_API_KEY[:20] + '...' if FAU_API_KEY else 'None'}")
 print(f"[DEBUG] FAU_MODEL: {FAU_MODEL}")
 
+# Appended to the pack's system prompt when several queries share one upstream call
+BATCH_PROMPT_SUFFIX = """
 
-def call_llm_directly(query: str) -> str:
+BATCH MODE: The user message is a JSON object mapping request ids to separate questions.
+Answer each question independently, following all rules above, and respond with ONLY a JSON object
+mapping every id to its answer object in the format above, for example:
+{"q1": {"summary": "...", "steps": [...]}, "q2": {"summary": "...", "steps": [...]}}"""
+
+
+def _record_shared_answer(content: str, start: float) -> None:
+    # Record a prefetched/batched answer as if it were an individual call so the trace replays without either
+    body = json.dumps({"choices": [{"message": {"role": "assistant", "content": content}}]})
+    traffic_capture.record_upstream(FAU_API_URL, 200, body, (time.perf_counter() - start) * 1000)
+
+
+def call_llm_directly(query: str, pack: Optional[KnowledgePack] = None, shared: bool = True,
+                      route: Optional[model_router.Route] = None) -> str:
     """
     Call the LLM directly using the OpenAI chat completions endpoint.
     Returns the LLM response for generating steps.
+    With shared=True the answer may come from a prefetch or a batched call instead.
+    route selects the model (default FAU_MODEL) and receives the call's latency/outcome.
     """
     print(f"[DEBUG] call_llm_directly called with: {query}")
+    pack = pack or knowledge_packs.get_pack()
+    
+    # Prefetched and batched answers are never used for replayed traffic
+    if shared and not traffic_capture.replaying():
+        start = time.perf_counter()
+        content = prefetcher.lookup(pack.id, query) if prefetcher else None
+        if content is not None:
+            _record_shared_answer(content, start)
+            print(f"[DEBUG] Answered from prefetch cache")
+            return content
+        
+        # Share an upstream call with concurrent queries when batching is on
+        if micro_batching.BATCH_ENABLED:
+            content = batcher.submit(pack.id, query, pack)
+            if content is not None:
+                _record_shared_answer(content, start)
+                print(f"[DEBUG] Answered from batched call")
+                return content
     
     headers = {
         "Content-Type": "application/json",
         "Authorization": f"Bearer {FAU_API_KEY}",
     }
     
-    # Enhanced prompt with specific FAU knowledge and example format
-    system_prompt = """You are FAU Assistant, an expert guide for Florida Atlantic University students.
-
-Your job is to provide detailed, accurate step-by-step instructions for navigating FAU's systems.
-
-IMPORTANT: You MUST respond with ONLY valid JSON in this exact format:
-{
-  "summary": "Brief description of the task",
-  "steps": [
-    {"instruction": "Detailed step instruction", "target_text": "UI Element Text"},
-    {"instruction": "Next step instruction", "target_text": "Button/Link Text"}
-  ]
-}
-
-FAU SYSTEM KNOWLEDGE:
-- MyFAU Portal (https://myfau.fau.edu): Access Student Self Service, Registration, Student Account, Financial Aid
-- Registration: MyFAU → Student Self Service → Registration → Register for Classes
-- Tuition Payment: MyFAU → Student Self Service → Student Account → Make a Payment
-- Financial Aid: FAU Financial Aid website (https://www.fau.edu/finaid) → Apply for Aid
-- Career Services: FAU Career Center (https://www.fau.edu/career) → Handshake (https://fau.joinhandshake.com)
-- Housing: FAU Housing website (https://www.fau.edu/housing) → Apply for Housing
-- Transcripts: MyFAU → Student Self Service → Academic Records → Request Transcript
-- Health Services: Student Health Services (https://www.fau.edu/studenthealth) → Schedule Appointment
-- Parking: Parking Services (https://www.fau.edu/parking) → Purchase Permit
-- Library: FAU Libraries (https://library.fau.edu) → Search Resources
-- Advising: Academic Advising → Schedule Appointment
-
-TARGET_TEXT RULES:
-- Should be the exact text visible on buttons, links, or menu items
-- Examples: "Student Self Service", "Register for Classes", "Make a Payment", "Apply for Aid"
-- Keep it short and specific to what appears on screen
-
-INSTRUCTION RULES:
-- For website navigation steps, use format: "Go to the FAU website" or "Go to MyFAU portal"
-- The content script will automatically add clickable links for common FAU websites
-- Be specific about which website to visit
-
-IMPORTANT: Always provide at least 3-4 actionable steps. Never return empty steps. If you don't have specific information about a service, provide general navigation steps to find it on the FAU website.
-
-DO NOT include any explanation, markdown, or text outside the JSON object."""
+    # System prompt comes from the request's knowledge pack (institution knowledge and example format)
+    system_prompt = pack.system_prompt
+    # Only now is the routing decision used; shared answers above always come from FAU_MODEL
+    model = route.begin() if route else FAU_MODEL
 
     payload = {
-        "model": FAU_MODEL,
+        "model": model,
         "messages": [
             {
                 "role": "system",
@@ -99,12 +104,13 @@ DO NOT include any explanation, markdown, or text outside the JSON object."""
     
     print(f"[DEBUG] Calling LLM with enhanced prompt...")
     
+    start = time.perf_counter()
     try:
         print(f"[DEBUG] Making POST request to {FAU_API_URL}")
         print(f"[DEBUG] Headers: Content-Type=application/json, Authorization=Bearer {FAU_API_KEY[:20]}...")
-        print(f"[DEBUG] Model: {FAU_MODEL}")
+        print(f"[DEBUG] Model: {model}")
         
-        resp = requests.post(FAU_API_URL, json=payload, headers=headers, timeout=60)
+        resp = traffic_capture.upstream_post(FAU_API_URL, json=payload, headers=headers, timeout=60)
         print(f"[DEBUG] Response status: {resp.status_code}")
         
         # Print response body even on error to debug
@@ -119,16 +125,128 @@ DO NOT include any explanation, markdown, or text outside the JSON object."""
         if 'choices' in result and len(result['choices']) > 0:
             content = result['choices'][0]['message']['content']
             print(f"[DEBUG] Raw LLM response: {content[:500]}...")
+            if route:
+                route.complete((time.perf_counter() - start) * 1000)
             return content
         else:
             raise RuntimeError("Invalid response format from LLM")
         
     except Exception as e:
         print(f"[DEBUG] ❌ LLM query failed: {e}")
+        if route:
+            route.fail((time.perf_counter() - start) * 1000)
         raise RuntimeError(f"LLM query failed: {e}")
 
 
-def orchestrate_via_llm(user_message: str) -> Dict[str, Any]:
+def call_llm_batch(pack: KnowledgePack, queries: Dict[str, str]) -> Dict[str, str]:
+    """
+    Answer several queries with one upstream call. Takes {id: query} and returns
+    {id: answer JSON text} for every id that came back with a usable answer.
+    """
+    print(f"[DEBUG] call_llm_batch called with {len(queries)} queries")
+    headers = {
+        "Content-Type": "application/json",
+        "Authorization": f"Bearer {FAU_API_KEY}",
+    }
+    payload = {
+        "model": FAU_MODEL,
+        "messages": [
+            {"role": "system", "content": pack.system_prompt + BATCH_PROMPT_SUFFIX},
+            {"role": "user", "content": f"Provide step-by-step instructions for each of these requests:\n{json.dumps(queries)}"}
+        ]
+    }
+    
+    # Each participant records its own slice of the answer in its trace
+    resp = traffic_capture.upstream_post(FAU_API_URL, json=payload, headers=headers, timeout=60, record=False)
+    resp.raise_for_status()
+    result = resp.json()
+    content = result['choices'][0]['message']['content']
+    answers = json.loads(extract_json_text(content))
+    if not isinstance(answers, dict):
+        raise RuntimeError("Batched response is not a JSON object")
+    
+    return {
+        qid: json.dumps(answer)
+        for qid, answer in answers.items()
+        if qid in queries and isinstance(answer, dict) and isinstance(answer.get('steps'), list)
+    }
+
+
+# Process-wide batcher; cheap to build, only used when BATCH_ENABLED
+batcher = micro_batching.MicroBatcher(call_llm_batch)
+
+
+def prefetch_guide(pack: KnowledgePack, query: str) -> Optional[str]:
+    """
+    Generate a guide in the background for the prefetch cache.
+    Returns the raw answer only if it parses into usable steps.
+    """
+    content = call_llm_directly(query, pack, shared=False)
+    if parse_steps_response(content, query, pack) is None:
+        return None
+    return content
+
+
+# Process-wide prefetcher; only built (and its worker thread started) when PREFETCH_ENABLED
+prefetcher = prefetch.Prefetcher(prefetch_guide) if prefetch.PREFETCH_ENABLED else None
+
+
+def extract_json_text(llm_response: str) -> str:
+    """
+    Strip markdown fences and surrounding prose from an LLM response, leaving the JSON object text.
+    """
+    # Try to extract JSON from response
+    json_text = llm_response.strip()
+    
+    # Look for JSON object if wrapped in markdown or extra text
+    if '```json' in json_text:
+        json_text = json_text.split('```json')[1].split('```')[0].strip()
+    elif '```' in json_text:
+        json_text = json_text.split('```')[1].split('```')[0].strip()
+    
+    # Find JSON object boundaries
+    if '{' in json_text and '}' in json_text:
+        start = json_text.find('{')
+        end = json_text.rfind('}') + 1
+        json_text = json_text[start:end]
+    
+    return json_text
+
+
+def parse_steps_response(llm_response: str, user_message: str, pack: Optional[KnowledgePack] = None) -> Optional[Dict[str, Any]]:
+    """
+    Extract and validate the {summary, steps} JSON object from a raw LLM response.
+    Returns None when the response has no usable steps.
+    """
+    json_text = extract_json_text(llm_response)
+    
+    # Parse JSON response
+    try:
+        result = json.loads(json_text)
+    
+        # Validate the structure
+        if 'steps' in result and isinstance(result['steps'], list):
+            valid_steps = []
+            for step in result['steps']:
+                if isinstance(step, dict) and 'instruction' in step:
+                    if 'target_text' not in step:
+                        step['target_text'] = extract_target_text(step['instruction'], pack)
+                    valid_steps.append(step)
+    
+            if valid_steps:
+                print(f"[DEBUG] ✅ Successfully parsed {len(valid_steps)} steps from LLM")
+                return {
+                    "summary": result.get('summary', f"Steps for: {user_message}"),
+                    "steps": valid_steps
+                }
+    
+    except json.JSONDecodeError as je:
+        print(f"[DEBUG] ❌ JSON decode error: {je}")
+    
+    return None
+
+
+def orchestrate_via_llm(user_message: str, pack: Optional[KnowledgePack] = None) -> Dict[str, Any]:
     """
     Query the LLM and convert response to structured steps.
     Returns dict with keys: summary (str) and steps (list of {instruction, target_text})
@@ -136,67 +254,33 @@ def orchestrate_via_llm(user_message: str) -> Dict[str, Any]:
     print(f"[DEBUG] orchestrate_via_llm called with: {user_message}")
     
     try:
+        # Pick the fastest model that meets the quality floor for this kind of query
+        route = model_router.choose('orchestrate', model_router.classify_orchestrate(user_message, pack))
+        
         # Query the LLM directly
-        llm_response = call_llm_directly(user_message)
+        llm_response = call_llm_directly(user_message, pack, route=route)
         print(f"[DEBUG] LLM response length: {len(llm_response)}")
         
-        # Try to extract JSON from response
-        json_text = llm_response.strip()
-        
-        # Look for JSON object if wrapped in markdown or extra text
-        if '```json' in json_text:
-            json_text = json_text.split('```json')[1].split('```')[0].strip()
-        elif '```' in json_text:
-            json_text = json_text.split('```')[1].split('```')[0].strip()
-        
-        # Find JSON object boundaries
-        if '{' in json_text and '}' in json_text:
-            start = json_text.find('{')
-            end = json_text.rfind('}') + 1
-            json_text = json_text[start:end]
-        
-        # Parse JSON response
-        try:
-            result = json.loads(json_text)
-            
-            # Validate the structure
-            if 'steps' in result and isinstance(result['steps'], list):
-                valid_steps = []
-                for step in result['steps']:
-                    if isinstance(step, dict) and 'instruction' in step:
-                        if 'target_text' not in step:
-                            step['target_text'] = extract_target_text(step['instruction'])
-                        valid_steps.append(step)
-                
-                if valid_steps:
-                    print(f"[DEBUG] ✅ Successfully parsed {len(valid_steps)} steps from LLM")
-                    return {
-                        "summary": result.get('summary', f"Steps for: {user_message}"),
-                        "steps": valid_steps
-                    }
-            
-        except json.JSONDecodeError as je:
-            print(f"[DEBUG] ❌ JSON decode error: {je}")
+        with traffic_capture.stage('parse'):
+            parsed = parse_steps_response(llm_response, user_message, pack)
+        route.validate(parsed is not None and len(parsed['steps']) >= model_router.ROUTER_MIN_STEPS)
+        if parsed:
+            return parsed
         
         # Fallback to predefined steps
-        return get_fallback_steps(user_message)
+        return get_fallback_steps(user_message, pack)
         
     except Exception as e:
         print(f"[DEBUG] ❌ LLM orchestration failed: {e}")
-        return get_fallback_steps(user_message)
+        return get_fallback_steps(user_message, pack)
 
 
-def extract_target_text(instruction: str) -> str:
+def extract_target_text(instruction: str, pack: Optional[KnowledgePack] = None) -> str:
     """
     Extract likely UI target text from instruction.
     """
-    # Common FAU UI elements
-    ui_patterns = [
-        'Student Self Service', 'Registration', 'Register for Classes',
-        'Student Account', 'Make a Payment', 'Financial Aid', 'Apply for Aid',
-        'FAFSA', 'Academic Records', 'Request Transcript', 'MyFAU',
-        'Student Portal', 'Career Center', 'Handshake', 'Housing', 'Apply'
-    ]
+    # UI elements and filler words come from the knowledge pack
+    pack = pack or knowledge_packs.get_pack()
     
     instruction_lower = instruction.lower()
     
@@ -208,12 +292,12 @@ def extract_target_text(instruction: str) -> str:
             return quotes[0]
     
     # Look for known UI patterns
-    for pattern in ui_patterns:
-        if pattern.lower() in instruction_lower:
+    for pattern, pattern_lower in zip(pack.ui_patterns, pack.ui_patterns_lower):
+        if pattern_lower in instruction_lower:
             return pattern
     
     # Extract meaningful words
-    words = [w for w in instruction.split() if w.lower() not in ['the', 'a', 'an', 'and', 'or', 'to', 'for', 'on', 'in', 'at', 'click', 'select', 'go', 'navigate']]
+    words = [w for w in instruction.split() if w.lower() not in pack.stopwords]
     if len(words) > 1:
         return ' '.join(words[-2:]).title()
     elif words:
@@ -222,66 +306,45 @@ def extract_target_text(instruction: str) -> str:
     return 'Next'
 
 
-def get_fallback_steps(user_query: str) -> Dict[str, Any]:
+def get_fallback_steps(user_query: str, pack: Optional[KnowledgePack] = None) -> Dict[str, Any]:
     """
-    Provide fallback steps based on query type.
+    Provide fallback steps based on query type, using the knowledge pack's guides.
     """
-    query_lower = user_query.lower()
-    
-    if "register" in query_lower or "registration" in query_lower:
-        return {
-            "summary": "How to register for classes at FAU",
-            "steps": [
-                {"instruction": "Go to MyFAU portal", "target_text": "MyFAU"},
-                {"instruction": "Log in with your FAU credentials", "target_text": "Login"},
-                {"instruction": "Click Student Self Service", "target_text": "Student Self Service"},
-                {"instruction": "Select Registration from the menu", "target_text": "Registration"},
-                {"instruction": "Click Register for Classes", "target_text": "Register for Classes"}
-            ]
-        }
-    elif "tuition" in query_lower or ("pay" in query_lower and "tuition" in query_lower):
-        return {
-            "summary": "How to pay tuition at FAU",
-            "steps": [
-                {"instruction": "Go to MyFAU portal", "target_text": "MyFAU"},
-                {"instruction": "Log in with your FAU credentials", "target_text": "Login"},
-                {"instruction": "Click Student Self Service", "target_text": "Student Self Service"},
-                {"instruction": "Select Student Account", "target_text": "Student Account"},
-                {"instruction": "Click Make a Payment", "target_text": "Make a Payment"}
-            ]
-        }
-    elif "financial aid" in query_lower or "fafsa" in query_lower:
-        return {
-            "summary": "How to apply for financial aid at FAU",
-            "steps": [
-                {"instruction": "Go to FAU Financial Aid website", "target_text": "Financial Aid"},
-                {"instruction": "Click Apply for Aid", "target_text": "Apply for Aid"},
-                {"instruction": "Complete the FAFSA application", "target_text": "FAFSA"},
-                {"instruction": "Submit required documents", "target_text": "Submit Documents"}
-            ]
-        }
-    else:
+    pack = pack or knowledge_packs.get_pack()
+    return pack.fallback_guide(user_query)
+
+
+def get_pack_fallback_steps(user_query: str, pack_id: Optional[str] = None) -> Dict[str, Any]:
+    """
+    Last-resort steps after an unexpected error, from the requested pack when it
+    can still be loaded and institution-neutral otherwise.
+    """
+    try:
+        return get_fallback_steps(user_query, knowledge_packs.get_pack(pack_id))
+    except Exception as e:
+        print(f"[DEBUG] ❌ Could not load knowledge pack {pack_id or knowledge_packs.DEFAULT_PACK} for fallback: {e}")
         return {
             "summary": f"General guidance for: {user_query}",
             "steps": [
-                {"instruction": "Go to the FAU website", "target_text": "FAU"},
-                {"instruction": "Use the search function to find information", "target_text": "Search"},
+                {"instruction": "Use the site's search function to find information", "target_text": "Search"},
                 {"instruction": "Navigate to the relevant department page", "target_text": "Department"},
                 {"instruction": "Contact the office for specific assistance", "target_text": "Contact"}
             ]
         }
 
 
-def orchestrate(user_message: str) -> Dict[str, Any]:
+def orchestrate(user_message: str, pack_id: Optional[str] = None) -> Dict[str, Any]:
     """
     Main orchestration function. Tries LangGraph if available, otherwise uses LLM directly.
+    pack_id selects the knowledge pack (default: DEFAULT_PACK).
     """
     print(f"\n{'='*60}")
     print(f"[DEBUG] 🚀 Orchestrate called with message: {user_message}")
-    print(f"[DEBUG] HAS_LANGGRAPH: {HAS_LANGGRAPH}")
+    print(f"[DEBUG] HAS_LANGGRAPH: {HAS_LANGGRAPH}, pack: {pack_id or knowledge_packs.DEFAULT_PACK}")
     print(f"{'='*60}\n")
     
     try:
+        pack = knowledge_packs.get_pack(pack_id)
         if HAS_LANGGRAPH:
             print("[DEBUG] ✓ Trying LangGraph...")
             try:
@@ -293,22 +356,14 @@ def orchestrate(user_message: str) -> Dict[str, Any]:
                 return {"summary": parsed.get('summary', ''), "steps": parsed.get('steps', [])}
             except Exception as e:
                 print(f"[DEBUG] ❌ LangGraph failed: {e}, falling back to LLM")
-                return orchestrate_via_llm(user_message)
+                return orchestrate_via_llm(user_message, pack)
         else:
             print("[DEBUG] ✓ No LangGraph detected, calling orchestrate_via_llm directly")
-            result = orchestrate_via_llm(user_message)
+            result = orchestrate_via_llm(user_message, pack)
             print(f"[DEBUG] ✅ Successfully got result from LLM")
             return result
             
     except Exception as e:
         print(f"[DEBUG] ❌❌❌ CRITICAL ERROR in orchestrate: {e}")
         # Ultimate fallback
-        return {
-            "summary": "Steps to register for classes at FAU",
-            "steps": [
-                {"instruction": "Go to the FAU Student Portal", "target_text": "Student Portal"},
-                {"instruction": "Click on Registration", "target_text": "Registration"},
-                {"instruction": "Select Register for Classes", "target_text": "Register for Classes"},
-                {"instruction": "Search and add your courses", "target_text": "Add Course"}
-            ]
-        }
\ No newline at end of file
+        return get_pack_fallback_steps(user_message, pack_id)
\ No newline at end of file
@@ -0,0 +1,161 @@
+"""
+Micro-batching of concurrent orchestrate queries into shared upstream calls.
+
+During spikes many distinct questions arrive within milliseconds of each other,
+and each one pays for its own chat completion carrying the same large system
+prompt. MicroBatcher groups pending queries (per knowledge pack) for up to
+BATCH_WINDOW_MS or BATCH_MAX_SIZE queries, issues one upstream call through
+the supplied `call_batch` function and hands each waiting thread its own
+result. The first query of a batch acts as the leader and makes the call, so
+no extra scheduler thread is needed.
+
+submit() returns None whenever a query should go upstream on its own: the
+query or batch would be oversized, the batch ended up with a single query, the
+batched call failed, or the response had no usable entry for the query.
+
+Enable with BATCH_ENABLED=1 and tune with BATCH_WINDOW_MS, BATCH_MAX_SIZE and
+BATCH_MAX_CHARS; stats() reports what each setting buys.
+"""
+from typing import Any, Callable, Dict, Optional
+import collections
+import os
+import threading
+import time
+
+BATCH_ENABLED = os.environ.get('BATCH_ENABLED', '0') == '1'
+BATCH_WINDOW_MS = float(os.environ.get('BATCH_WINDOW_MS', 30))
+BATCH_MAX_SIZE = int(os.environ.get('BATCH_MAX_SIZE', 8))
+# Total query text per batch; keeps the keyed response well inside the model's output budget
+BATCH_MAX_CHARS = int(os.environ.get('BATCH_MAX_CHARS', 4000))
+# How long followers wait for the leader's upstream call before going it alone
+BATCH_RESULT_TIMEOUT = float(os.environ.get('BATCH_RESULT_TIMEOUT', 90))
+
+
+def _normalize(query: str) -> str:
+    return ' '.join(query.lower().split())
+
+
+class _Batch:
+    def __init__(self):
+        self.queries: Dict[str, str] = {}  # normalized -> original text
+        self.chars = 0
+        self.results: Dict[str, Optional[str]] = {}
+        self.full = threading.Event()
+        self.done = threading.Event()
+
+
+class MicroBatcher:
+    """Collects concurrent queries into batches; see the module docstring."""
+
+    def __init__(self, call_batch: Callable[[Any, Dict[str, str]], Dict[str, str]],
+                 window: float = BATCH_WINDOW_MS / 1000, max_size: int = BATCH_MAX_SIZE,
+                 max_chars: int = BATCH_MAX_CHARS):
+        self.call_batch = call_batch
+        self.window = window
+        self.max_size = max_size
+        self.max_chars = max_chars
+        self._open: Dict[str, _Batch] = {}
+        self._lock = threading.Lock()
+        self._counters: "collections.Counter[str]" = collections.Counter()
+        self._sizes: "collections.Counter[int]" = collections.Counter()
+        self._wait_ms = 0.0
+        self._latencies: "collections.deque[float]" = collections.deque(maxlen=500)
+
+    def submit(self, group: str, query: str, context: Any) -> Optional[str]:
+        """
+        Add query to the open batch for `group` and block until it has been
+        answered. Returns the raw response text for this query, or None if the
+        caller should make an individual call instead.
+        """
+        key = _normalize(query)
+        if len(query) > self.max_chars:
+            self._count('oversized')
+            return None
+
+        with self._lock:
+            batch = self._open.get(group)
+            leader = batch is None or not (
+                key in batch.queries
+                or (len(batch.queries) < self.max_size and batch.chars + len(query) <= self.max_chars)
+            )
+            if leader:
+                batch = _Batch()
+                self._open[group] = batch
+            if key not in batch.queries:
+                batch.queries[key] = query
+                batch.chars += len(query)
+            else:
+                self._counters['deduplicated'] += 1
+            if len(batch.queries) >= self.max_size:
+                # Size cap reached: close it now so the leader stops waiting
+                self._open.pop(group, None)
+                batch.full.set()
+
+        if leader:
+            start = time.perf_counter()
+            batch.full.wait(self.window)
+            with self._lock:
+                if self._open.get(group) is batch:
+                    del self._open[group]
+                self._wait_ms += (time.perf_counter() - start) * 1000
+            self._run(batch, context)
+        elif not batch.done.wait(BATCH_RESULT_TIMEOUT):
+            self._count('timeouts')
+            return None
+
+        result = batch.results.get(key)
+        if result is None and len(batch.queries) > 1:
+            self._count('fallbacks')
+        return result
+
+    def _run(self, batch: _Batch, context: Any) -> None:
+        try:
+            with self._lock:
+                self._sizes[len(batch.queries)] += 1
+            if len(batch.queries) == 1:
+                self._count('singletons')
+                return
+            ids = {f"q{i}": key for i, key in enumerate(batch.queries, 1)}
+            start = time.perf_counter()
+            try:
+                answers = self.call_batch(context, {qid: batch.queries[key] for qid, key in ids.items()})
+            except Exception as e:
+                print(f"[DEBUG] ❌ Batched call for {len(ids)} queries failed, falling back: {e}")
+                self._count('failed_batches')
+                return
+            with self._lock:
+                self._latencies.append((time.perf_counter() - start) * 1000)
+                self._counters['batches'] += 1
+                self._counters['batched_queries'] += len(ids)
+            for qid, key in ids.items():
+                batch.results[key] = answers.get(qid)
+            print(f"[DEBUG] ✅ Batched call answered {sum(1 for v in batch.results.values() if v)}/{len(ids)} queries")
+        finally:
+            batch.done.set()
+
+    def _count(self, name: str) -> None:
+        with self._lock:
+            self._counters[name] += 1
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            latencies = sorted(self._latencies)
+            closed = sum(self._sizes.values())
+            counters = dict(self._counters)
+            sizes = dict(sorted(self._sizes.items()))
+            wait_ms = self._wait_ms
+
+        def pct(p: float) -> float:
+            return round(latencies[min(len(latencies) - 1, int(p / 100 * len(latencies)))], 1) if latencies else 0.0
+
+        return {
+            "enabled": BATCH_ENABLED,
+            "window_ms": self.window * 1000,
+            "max_size": self.max_size,
+            "max_chars": self.max_chars,
+            "counters": counters,
+            "batch_sizes": sizes,
+            "upstream_calls_saved": counters.get('batched_queries', 0) - counters.get('batches', 0),
+            "mean_window_wait_ms": round(wait_ms / closed, 2) if closed else 0.0,
+            "batch_latency_ms": {"p50": pct(50), "p95": pct(95), "p99": pct(99)},
+        }
@@ -0,0 +1,219 @@
+"""
+Adaptive, latency-aware model selection for orchestrate and draft calls.
+
+Every request is classified as 'simple' or 'complex' from cheap signals
+(query length, how many distinct intents it touches, multi-step wording,
+chat history size). For each (model, task, tier) the router keeps a sliding
+window of latencies, errors and output validity, where valid means "met the
+quality floor": step JSON with at least ROUTER_MIN_STEPS steps for orchestrate,
+a non-empty reply for drafts. It then picks the fastest model whose validity
+rate is at least ROUTER_QUALITY_FLOOR and whose error rate is at most
+ROUTER_MAX_ERROR_RATE. With ROUTER_EXPLORE probability it tries a random model
+instead, so stats stay fresh and new models get measured. Until a model has
+ROUTER_MIN_SAMPLES samples for a tier it can only be chosen by exploration,
+and FAU_MODEL is used when nothing qualifies.
+
+A decision only counts once the caller commits to an upstream call with
+Route.begin(); orchestrate answers served from the prefetch cache or a shared
+batched call (both always FAU_MODEL) bypass routing and are not recorded.
+
+Candidates come from FAU_MODELS (comma-separated, all served by the same
+OpenAI-compatible endpoint); with a single model the router is a no-op.
+stats() exposes per-model latency percentiles and the recent decisions.
+"""
+from typing import Any, Dict, List, Optional, Tuple
+import collections
+import os
+import random
+import threading
+import time
+import traffic_capture
+
+FAU_MODEL = os.environ.get('FAU_MODEL', 'gemini-2.0-flash-lite')
+FAU_MODELS = [m.strip() for m in os.environ.get('FAU_MODELS', '').split(',') if m.strip()]
+ROUTER_QUALITY_FLOOR = float(os.environ.get('ROUTER_QUALITY_FLOOR', 0.9))
+ROUTER_MAX_ERROR_RATE = float(os.environ.get('ROUTER_MAX_ERROR_RATE', 0.1))
+ROUTER_MIN_STEPS = int(os.environ.get('ROUTER_MIN_STEPS', 3))
+ROUTER_MIN_SAMPLES = int(os.environ.get('ROUTER_MIN_SAMPLES', 10))
+ROUTER_EXPLORE = float(os.environ.get('ROUTER_EXPLORE', 0.05))
+ROUTER_WINDOW = int(os.environ.get('ROUTER_WINDOW', 200))
+# Complexity thresholds
+ROUTER_COMPLEX_WORDS = int(os.environ.get('ROUTER_COMPLEX_WORDS', 25))
+ROUTER_COMPLEX_EMAIL_CHARS = int(os.environ.get('ROUTER_COMPLEX_EMAIL_CHARS', 1500))
+ROUTER_COMPLEX_HISTORY = int(os.environ.get('ROUTER_COMPLEX_HISTORY', 4))
+
+SIMPLE, COMPLEX = 'simple', 'complex'
+
+_MULTI_STEP_WORDS = (' then ', ' after ', ' before ', ' also ', ' both ', ' as well as ')
+
+
+def classify_orchestrate(query: str, pack: Any = None) -> str:
+    """Cheap complexity estimate for an orchestrate query."""
+    words = len(query.split())
+    if words > ROUTER_COMPLEX_WORDS:
+        return COMPLEX
+    q = f" {query.lower()} "
+    intents = 0
+    if pack is not None:
+        intents = sum(1 for guide in pack.fallback_guides if any(k in q for k in guide['keywords']))
+    if intents >= 2 or (words > 8 and any(w in q for w in _MULTI_STEP_WORDS)):
+        return COMPLEX
+    return SIMPLE
+
+
+def classify_draft(email_text: str, history_size: int) -> str:
+    """Cheap complexity estimate for a draft reply."""
+    if len(email_text) > ROUTER_COMPLEX_EMAIL_CHARS or history_size > ROUTER_COMPLEX_HISTORY:
+        return COMPLEX
+    return SIMPLE
+
+
+class _ModelStats:
+    def __init__(self):
+        self.latencies: "collections.deque[float]" = collections.deque(maxlen=ROUTER_WINDOW)
+        self.errors: "collections.deque[bool]" = collections.deque(maxlen=ROUTER_WINDOW)
+        self.valid: "collections.deque[bool]" = collections.deque(maxlen=ROUTER_WINDOW)
+
+    @property
+    def samples(self) -> int:
+        return len(self.errors)
+
+    @property
+    def error_rate(self) -> float:
+        return sum(self.errors) / len(self.errors) if self.errors else 0.0
+
+    @property
+    def validity_rate(self) -> float:
+        return sum(self.valid) / len(self.valid) if self.valid else 0.0
+
+    def percentile(self, p: float) -> float:
+        if not self.latencies:
+            return 0.0
+        ordered = sorted(self.latencies)
+        return ordered[min(len(ordered) - 1, int(p / 100 * len(ordered)))]
+
+
+class Route:
+    """One routing decision; call begin() before the upstream call, then fail() or complete() and validate()."""
+
+    def __init__(self, router: "ModelRouter", task: str, tier: str, model: str, reason: str):
+        self.router = router
+        self.task = task
+        self.tier = tier
+        self.model = model
+        self.reason = reason
+        self.latency_ms: Optional[float] = None
+        self._recording = not traffic_capture.replaying()
+        self._begun = False
+
+    def begin(self) -> str:
+        """The upstream call is about to be made with this route: count the decision and return the model."""
+        if not self._begun:
+            self._begun = True
+            self.router.log_decision(self)
+        return self.model
+
+    def complete(self, latency_ms: float) -> None:
+        """The upstream call with self.model succeeded; validity follows via validate()."""
+        self.latency_ms = latency_ms
+
+    def fail(self, latency_ms: float) -> None:
+        if self._recording:
+            self.router.record(self, latency_ms, error=True, valid=False)
+            self._recording = False
+
+    def validate(self, valid: bool) -> None:
+        """Record the outcome. No-op if the answer did not come from this route's own upstream call."""
+        if self._recording and self.latency_ms is not None:
+            self.router.record(self, self.latency_ms, error=False, valid=valid)
+            self._recording = False
+
+
+class ModelRouter:
+    """Tracks per-model stats and picks a model per request; see the module docstring."""
+
+    def __init__(self, models: List[str], default: str):
+        self.models = models
+        self.default = default
+        self._stats: Dict[Tuple[str, str, str], _ModelStats] = {}
+        self._decisions: "collections.Counter[Tuple[str, str, str, str]]" = collections.Counter()
+        self._recent: "collections.deque[Dict[str, Any]]" = collections.deque(maxlen=50)
+        self._lock = threading.Lock()
+
+    def choose(self, task: str, tier: str) -> Route:
+        if len(self.models) == 1:
+            return Route(self, task, tier, self.models[0], 'single')
+        with self._lock:
+            if random.random() < ROUTER_EXPLORE:
+                model, reason = random.choice(self.models), 'explore'
+            else:
+                eligible = []
+                for m in self.models:
+                    st = self._stats.get((m, task, tier))
+                    if st is None or st.samples < ROUTER_MIN_SAMPLES:
+                        continue
+                    if st.validity_rate >= ROUTER_QUALITY_FLOOR and st.error_rate <= ROUTER_MAX_ERROR_RATE:
+                        eligible.append((st.percentile(50), m))
+                if eligible:
+                    model, reason = min(eligible)[1], 'fastest'
+                else:
+                    model, reason = self.default, 'default'
+        return Route(self, task, tier, model, reason)
+
+    def log_decision(self, route: Route) -> None:
+        if len(self.models) == 1:
+            return
+        with self._lock:
+            self._decisions[(route.task, route.tier, route.model, route.reason)] += 1
+            self._recent.append({"ts": round(time.time(), 3), "task": route.task, "tier": route.tier,
+                                 "model": route.model, "reason": route.reason})
+        print(f"[DEBUG] Router: {route.task}/{route.tier} -> {route.model} ({route.reason})")
+
+    def record(self, route: Route, latency_ms: float, error: bool, valid: bool) -> None:
+        with self._lock:
+            st = self._stats.setdefault((route.model, route.task, route.tier), _ModelStats())
+            st.errors.append(error)
+            st.valid.append(valid)
+            if not error:
+                st.latencies.append(latency_ms)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            models = [
+                {
+                    "model": model, "task": task, "tier": tier,
+                    "samples": st.samples,
+                    "error_rate": round(st.error_rate, 3),
+                    "validity_rate": round(st.validity_rate, 3),
+                    "latency_ms": {f"p{p}": round(st.percentile(p), 1) for p in (50, 90, 95, 99)},
+                    "eligible": (st.samples >= ROUTER_MIN_SAMPLES and st.validity_rate >= ROUTER_QUALITY_FLOOR
+                                 and st.error_rate <= ROUTER_MAX_ERROR_RATE),
+                }
+                for (model, task, tier), st in sorted(self._stats.items())
+            ]
+            decisions = [
+                {"task": task, "tier": tier, "model": model, "reason": reason, "count": n}
+                for (task, tier, model, reason), n in sorted(self._decisions.items())
+            ]
+            return {
+                "models": self.models,
+                "default": self.default,
+                "quality_floor": ROUTER_QUALITY_FLOOR,
+                "max_error_rate": ROUTER_MAX_ERROR_RATE,
+                "min_samples": ROUTER_MIN_SAMPLES,
+                "explore": ROUTER_EXPLORE,
+                "per_model": models,
+                "decisions": decisions,
+                "recent": list(self._recent),
+            }
+
+
+_router = ModelRouter([FAU_MODEL] + [m for m in FAU_MODELS if m != FAU_MODEL], FAU_MODEL)
+
+
+def choose(task: str, tier: str) -> Route:
+    return _router.choose(task, tier)
+
+
+def stats() -> Dict[str, Any]:
+    return _router.stats()
@@ -0,0 +1,198 @@
+"""
+Predictive prefetch of follow-up guides using idle upstream capacity.
+
+Students asking one question tend to ask a predictable next one (registration
+-> tuition payment -> adding a course). The Prefetcher learns question to
+question transitions per client from /orchestrate traffic and, after each
+question, queues the likely follow-ups. A single background worker generates
+them only while upstream utilization (in-flight calls / UPSTREAM_CAPACITY) is
+below PREFETCH_MAX_UTILIZATION, re-checking right before every call so
+interactive traffic always goes first, and keeps at most one prefetch in
+flight. Generated answers wait in a TTL cache that call_llm_directly consults
+before going upstream.
+
+stats() reports hit rate and wasted calls (failed generations plus entries
+that expired or were evicted unused) so the feature can be judged on data.
+Enable with PREFETCH_ENABLED=1.
+"""
+from typing import Any, Callable, Dict, Optional, Tuple
+import collections
+import os
+import queue
+import threading
+import time
+import knowledge_packs
+import traffic_capture
+
+PREFETCH_ENABLED = os.environ.get('PREFETCH_ENABLED', '0') == '1'
+UPSTREAM_CAPACITY = int(os.environ.get('UPSTREAM_CAPACITY', 8))
+PREFETCH_MAX_UTILIZATION = float(os.environ.get('PREFETCH_MAX_UTILIZATION', 0.5))
+PREFETCH_MIN_COUNT = int(os.environ.get('PREFETCH_MIN_COUNT', 3))
+PREFETCH_MIN_PROBABILITY = float(os.environ.get('PREFETCH_MIN_PROBABILITY', 0.3))
+PREFETCH_TOP_K = int(os.environ.get('PREFETCH_TOP_K', 2))
+PREFETCH_TTL = float(os.environ.get('PREFETCH_TTL', 1800))
+PREFETCH_CACHE_SIZE = int(os.environ.get('PREFETCH_CACHE_SIZE', 500))
+# Follow-up questions further apart than this start a new session
+PREFETCH_SESSION_GAP = float(os.environ.get('PREFETCH_SESSION_GAP', 1800))
+# Bounds on the learned statistics
+PREFETCH_MAX_QUESTIONS = int(os.environ.get('PREFETCH_MAX_QUESTIONS', 5000))
+PREFETCH_MAX_CLIENTS = int(os.environ.get('PREFETCH_MAX_CLIENTS', 10000))
+# Queued prefetches older than this are dropped; the student has moved on
+PREFETCH_MAX_QUEUE_AGE = float(os.environ.get('PREFETCH_MAX_QUEUE_AGE', 60))
+
+Key = Tuple[str, str]  # (pack id, normalized question)
+
+
+def _normalize(query: str) -> str:
+    return ' '.join(query.lower().split())
+
+
+class Prefetcher:
+    """Learns transitions, schedules prefetches and serves their results; see the module docstring."""
+
+    def __init__(self, generate: Callable[[Any, str], Optional[str]]):
+        # generate(pack, query) returns validated answer text, or None if unusable
+        self.generate = generate
+        self._lock = threading.Lock()
+        self._transitions: "collections.OrderedDict[Key, collections.Counter]" = collections.OrderedDict()
+        self._texts: "collections.OrderedDict[Key, str]" = collections.OrderedDict()
+        self._last: "collections.OrderedDict[str, Tuple[Key, float]]" = collections.OrderedDict()
+        self._cache: "collections.OrderedDict[Key, Tuple[str, float]]" = collections.OrderedDict()
+        self._pending: set = set()
+        self._queue: "queue.Queue[Tuple[Key, float]]" = queue.Queue()
+        self._inflight = 0
+        self._counters: "collections.Counter[str]" = collections.Counter()
+        self._thread = threading.Thread(target=self._run, name='prefetch-worker', daemon=True)
+        self._thread.start()
+
+    # -- interactive path ------------------------------------------------------
+
+    def observe(self, client: str, pack_id: str, query: str) -> None:
+        """Record that `client` asked `query` and queue its likely follow-ups."""
+        key = (pack_id, _normalize(query))
+        now = time.time()
+        with self._lock:
+            self._texts[key] = query
+            self._texts.move_to_end(key)
+            while len(self._texts) > PREFETCH_MAX_QUESTIONS:
+                self._texts.popitem(last=False)
+            previous = self._last.pop(client, None)
+            self._last[client] = (key, now)
+            while len(self._last) > PREFETCH_MAX_CLIENTS:
+                self._last.popitem(last=False)
+            if previous is not None and previous[0] != key and now - previous[1] <= PREFETCH_SESSION_GAP:
+                self._transitions.setdefault(previous[0], collections.Counter())[key] += 1
+                self._transitions.move_to_end(previous[0])
+                while len(self._transitions) > PREFETCH_MAX_QUESTIONS:
+                    self._transitions.popitem(last=False)
+
+            successors = self._transitions.get(key)
+            if not successors:
+                return
+            total = sum(successors.values())
+            for candidate, count in successors.most_common(PREFETCH_TOP_K):
+                if count < PREFETCH_MIN_COUNT or count / total < PREFETCH_MIN_PROBABILITY:
+                    break
+                if candidate in self._pending or self._fresh(candidate, now):
+                    continue
+                self._pending.add(candidate)
+                self._queue.put((candidate, now))
+                self._counters['queued'] += 1
+
+    def lookup(self, pack_id: str, query: str) -> Optional[str]:
+        """Return a prefetched answer for this question, consuming it."""
+        key = (pack_id, _normalize(query))
+        with self._lock:
+            entry = self._cache.pop(key, None)
+            if entry is None:
+                self._counters['misses'] += 1
+                return None
+            if entry[1] < time.time():
+                self._counters['expired_unused'] += 1
+                self._counters['misses'] += 1
+                return None
+            self._counters['hits'] += 1
+            return entry[0]
+
+    # -- background worker -----------------------------------------------------
+
+    def _fresh(self, key: Key, now: float) -> bool:
+        entry = self._cache.get(key)
+        return entry is not None and entry[1] >= now
+
+    def _upstream_busy(self) -> bool:
+        return traffic_capture.upstream_inflight() / max(UPSTREAM_CAPACITY, 1) >= PREFETCH_MAX_UTILIZATION
+
+    def _run(self) -> None:
+        while True:
+            key, queued_at = self._queue.get()
+            try:
+                # Wait for idle capacity, giving up once the prediction is stale
+                if self._upstream_busy():
+                    self._count('deferred_busy')
+                while self._upstream_busy() and time.time() - queued_at < PREFETCH_MAX_QUEUE_AGE:
+                    time.sleep(0.05)
+                if time.time() - queued_at >= PREFETCH_MAX_QUEUE_AGE:
+                    self._count('dropped_stale')
+                    continue
+                self._prefetch(key)
+            finally:
+                with self._lock:
+                    self._pending.discard(key)
+
+    def _prefetch(self, key: Key) -> None:
+        pack_id, _ = key
+        query = self._texts.get(key)
+        if query is None:
+            return
+        with self._lock:
+            self._inflight += 1
+            self._counters['calls'] += 1
+        try:
+            content = self.generate(knowledge_packs.get_pack(pack_id), query)
+        except Exception as e:
+            print(f"[DEBUG] ❌ Prefetch failed for {query!r}: {e}")
+            content = None
+        finally:
+            with self._lock:
+                self._inflight -= 1
+
+        with self._lock:
+            if content is None:
+                self._counters['failed'] += 1
+                return
+            self._cache[key] = (content, time.time() + PREFETCH_TTL)
+            self._cache.move_to_end(key)
+            self._counters['stored'] += 1
+            while len(self._cache) > PREFETCH_CACHE_SIZE:
+                self._cache.popitem(last=False)
+                self._counters['evicted_unused'] += 1
+        print(f"[DEBUG] ✅ Prefetched guide for {query!r}")
+
+    def _count(self, name: str) -> None:
+        with self._lock:
+            self._counters[name] += 1
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            c = dict(self._counters)
+            now = time.time()
+            cached = sum(1 for _, expires in self._cache.values() if expires >= now)
+            questions = len(self._transitions)
+            inflight = self._inflight
+        wasted = c.get('failed', 0) + c.get('expired_unused', 0) + c.get('evicted_unused', 0)
+        calls = c.get('calls', 0)
+        lookups = c.get('hits', 0) + c.get('misses', 0)
+        return {
+            "enabled": PREFETCH_ENABLED,
+            "counters": c,
+            "cached": cached,
+            "inflight": inflight,
+            "questions_tracked": questions,
+            # Share of prefetch calls that ended up serving a request
+            "hit_rate": round(c.get('hits', 0) / calls, 3) if calls else 0.0,
+            # Share of all orchestrate lookups answered from prefetch
+            "coverage": round(c.get('hits', 0) / lookups, 3) if lookups else 0.0,
+            "wasted_calls": wasted,
+            "upstream_utilization": round(traffic_capture.upstream_inflight() / max(UPSTREAM_CAPACITY, 1), 3),
+        }
@@ -0,0 +1,314 @@
+"""
+On-demand profiling for a live backend worker.
+
+Two modes, both behind the admin token in PROFILING_TOKEN (the endpoints are
+hidden entirely when it is unset):
+
+- Sampling: a background thread snapshots every thread's stack at a fixed
+  interval for T seconds or until N requests have completed, keeping only
+  stacks that pass through backend code (orchestrator, JSON extraction,
+  extract_target_text, draft path). Results are exported as a speedscope
+  file, folded stacks (flamegraph.pl input) or a self-contained SVG flame graph.
+- Per-request: a request carrying the admin token and X-Profile-Request: <tag>
+  is run under cProfile and the stats are kept under that tag.
+
+Nothing is installed on the request path beyond a header lookup, so the cost
+when no session is running is effectively zero.
+"""
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+import collections
+import contextlib
+import cProfile
+import functools
+import hmac
+import html
+import io
+import json
+import marshal
+import os
+import pathlib
+import pstats
+import sys
+import threading
+import time
+from fastapi import HTTPException, Request
+
+PROFILING_TOKEN = os.environ.get('PROFILING_TOKEN', '')
+PROFILING_MAX_SECONDS = float(os.environ.get('PROFILING_MAX_SECONDS', 120))
+PROFILING_KEEP_RESULTS = int(os.environ.get('PROFILING_KEEP_RESULTS', 20))
+
+ADMIN_HEADER = 'X-Admin-Token'
+PROFILE_HEADER = 'X-Profile-Request'
+
+_BACKEND_DIR = str(pathlib.Path(__file__).resolve().parent)
+_THIS_FILE = str(pathlib.Path(__file__).resolve())
+
+Frame = Tuple[str, str, int]  # (function name, file, first line)
+
+
+def require_admin(request: Request) -> None:
+    """Reject the request unless it carries the configured admin token."""
+    if not PROFILING_TOKEN:
+        raise HTTPException(status_code=404, detail="Not Found")
+    token = request.headers.get(ADMIN_HEADER, '')
+    if not _token_matches(token):
+        raise HTTPException(status_code=403, detail="Invalid admin token")
+
+
+def _token_matches(token: str) -> bool:
+    # Starlette decodes headers as latin-1; compare bytes so non-ASCII values are just a mismatch
+    return hmac.compare_digest(token.encode('latin-1'), PROFILING_TOKEN.encode('utf-8'))
+
+
+def _is_admin(request: Request) -> bool:
+    token = request.headers.get(ADMIN_HEADER)
+    return bool(PROFILING_TOKEN and token and _token_matches(token))
+
+
+@functools.lru_cache(maxsize=4096)
+def _is_backend_file(filename: str) -> bool:
+    """Modules directly in backend/, not the profiler itself or a backend/.venv install."""
+    if filename.startswith('<'):
+        return False  # <frozen ...>, <string>
+    path = os.path.abspath(filename)
+    return os.path.dirname(path) == _BACKEND_DIR and path != _THIS_FILE
+
+
+class SamplingSession:
+    """Samples the stacks of all other threads every `interval` seconds."""
+
+    def __init__(self, interval: float):
+        self.interval = interval
+        self.stacks: "collections.Counter[Tuple[Frame, ...]]" = collections.Counter()
+        self.samples = 0
+        self.requests_done = 0
+        self.started = time.time()
+        self.duration = 0.0
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name='profiling-sampler', daemon=True)
+
+    def start(self) -> None:
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+        self._thread.join()
+        self.duration = time.time() - self.started
+
+    def _run(self) -> None:
+        own = threading.get_ident()
+        while not self._stop.wait(self.interval):
+            for tid, frame in sys._current_frames().items():
+                if tid == own:
+                    continue
+                stack: List[Frame] = []
+                ours = False
+                f = frame
+                while f is not None:
+                    code = f.f_code
+                    if not ours and _is_backend_file(code.co_filename):
+                        ours = True
+                    stack.append((code.co_name, code.co_filename, code.co_firstlineno))
+                    f = f.f_back
+                # Idle event loop / worker threads never touch backend code
+                if ours:
+                    stack.reverse()
+                    self.stacks[tuple(stack)] += 1
+                    self.samples += 1
+
+    # -- exporters ---------------------------------------------------------
+
+    @staticmethod
+    def _label(frame: Frame) -> str:
+        name, filename, line = frame
+        return f"{name} ({os.path.basename(filename)}:{line})"
+
+    def folded(self) -> str:
+        """Collapsed stacks, one 'root;...;leaf count' line per unique stack."""
+        lines = [';'.join(self._label(fr) for fr in stack) + f" {count}" for stack, count in self.stacks.most_common()]
+        return '\n'.join(lines) + '\n'
+
+    def speedscope(self) -> Dict[str, Any]:
+        """Speedscope file (https://www.speedscope.app/file-format-schema.json)."""
+        frame_index: Dict[Frame, int] = {}
+        frames: List[Dict[str, Any]] = []
+        samples: List[List[int]] = []
+        weights: List[float] = []
+        interval_ms = self.interval * 1000
+        for stack, count in self.stacks.items():
+            ids = []
+            for fr in stack:
+                if fr not in frame_index:
+                    frame_index[fr] = len(frames)
+                    frames.append({"name": fr[0], "file": fr[1], "line": fr[2]})
+                ids.append(frame_index[fr])
+            samples.append(ids)
+            weights.append(count * interval_ms)
+        total = sum(weights)
+        return {
+            "$schema": "https://www.speedscope.app/file-format-schema.json",
+            "name": f"backend profile ({self.samples} samples, {self.requests_done} requests)",
+            "exporter": "fau-assistant-backend",
+            "activeProfileIndex": 0,
+            "shared": {"frames": frames},
+            "profiles": [{
+                "type": "sampled",
+                "name": "backend",
+                "unit": "milliseconds",
+                "startValue": 0,
+                "endValue": total,
+                "samples": samples,
+                "weights": weights,
+            }],
+        }
+
+    def svg(self, width: int = 1200, row_height: int = 17) -> str:
+        """Minimal standalone flame graph; hover a box for its sample count."""
+        root: Dict[str, Any] = {"count": 0, "children": {}}
+        for stack, count in self.stacks.items():
+            node = root
+            node["count"] += count
+            for fr in stack:
+                node = node["children"].setdefault(self._label(fr), {"count": 0, "children": {}})
+                node["count"] += count
+
+        def depth(node: Dict[str, Any]) -> int:
+            return 1 + max((depth(c) for c in node["children"].values()), default=0)
+
+        height = (depth(root) + 1) * row_height
+        total = max(root["count"], 1)
+        boxes: List[str] = []
+
+        def draw(node: Dict[str, Any], label: str, x: float, level: int) -> None:
+            w = node["count"] / total * width
+            if w < 0.5:
+                return
+            y = height - (level + 1) * row_height
+            hue = 20 + (hash(label) % 40)
+            pct = node["count"] / total * 100
+            boxes.append(
+                f'<g><title>{html.escape(label)} ({node["count"]} samples, {pct:.1f}%)</title>'
+                f'<rect x="{x:.1f}" y="{y}" width="{w:.1f}" height="{row_height - 1}" fill="hsl({hue},90%,60%)"/>'
+                f'<text x="{x + 3:.1f}" y="{y + row_height - 5}">{html.escape(label[:int(w / 7)])}</text></g>'
+            )
+            cx = x
+            for child_label, child in sorted(node["children"].items()):
+                draw(child, child_label, cx, level + 1)
+                cx += child["count"] / total * width
+
+        draw(root, f"all ({self.requests_done} requests)", 0.0, 0)
+        return (
+            f'<svg xmlns="http://www.w3.org/2000/svg" width="{width}" height="{height}" '
+            f'font-family="monospace" font-size="11">' + ''.join(boxes) + '</svg>'
+        )
+
+
+_session: Optional[SamplingSession] = None
+_session_lock = threading.Lock()
+
+
+def start_sampling(interval: float) -> SamplingSession:
+    """Start the process-wide sampling session; only one may run at a time."""
+    global _session
+    with _session_lock:
+        if _session is not None:
+            raise HTTPException(status_code=409, detail="A profiling session is already running")
+        _session = SamplingSession(interval)
+        _session.start()
+        print(f"[DEBUG] Sampling profiler started ({interval * 1000:.1f} ms interval)")
+        return _session
+
+
+def stop_sampling() -> Optional[SamplingSession]:
+    global _session
+    with _session_lock:
+        session, _session = _session, None
+    if session is not None:
+        session.stop()
+        print(f"[DEBUG] Sampling profiler stopped: {session.samples} samples, {session.requests_done} requests")
+    return session
+
+
+def export(session: SamplingSession, fmt: str) -> Tuple[str, str, str]:
+    """Return (body, media type, filename) for a finished session."""
+    stamp = time.strftime('%Y%m%d-%H%M%S', time.localtime(session.started))
+    if fmt == 'folded':
+        return session.folded(), 'text/plain', f"profile-{stamp}.folded"
+    if fmt == 'svg':
+        return session.svg(), 'image/svg+xml', f"profile-{stamp}.svg"
+    return json.dumps(session.speedscope()), 'application/json', f"profile-{stamp}.speedscope.json"
+
+
+_request_profiles: "collections.OrderedDict[str, Dict[str, Any]]" = collections.OrderedDict()
+_cprofile_lock = threading.Lock()
+
+
+def profile_tag(request: Request) -> Optional[str]:
+    """The request's X-Profile-Request tag if it also carries the admin token, else None."""
+    tag = request.headers.get(PROFILE_HEADER)
+    return tag if tag and _is_admin(request) else None
+
+
+@contextlib.contextmanager
+def profiled(request: Request) -> Iterator[None]:
+    """
+    Wrap the handling of one request: counts it toward a running sampling
+    session and, if it is tagged with X-Profile-Request by an admin, runs it
+    under cProfile.
+    """
+    with profiled_as(profile_tag(request), request.url.path):
+        yield
+
+
+@contextlib.contextmanager
+def profiled_as(tag: Optional[str], path: str) -> Iterator[None]:
+    """profiled() for work that runs away from its request (e.g. draft jobs); tag comes from profile_tag()."""
+    profiler = None
+    if tag and _cprofile_lock.acquire(blocking=False):
+        profiler = cProfile.Profile()
+        profiler.enable()
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        if profiler is not None:
+            profiler.disable()
+            try:
+                # Only the lock holder stores, so concurrent stores can't interleave
+                _store_request_profile(tag, path, profiler, time.perf_counter() - start)
+            finally:
+                _cprofile_lock.release()
+        session = _session
+        if session is not None:
+            session.requests_done += 1
+
+
+def _store_request_profile(tag: str, path: str, profiler: cProfile.Profile, elapsed: float) -> None:
+    text = io.StringIO()
+    stats = pstats.Stats(profiler, stream=text)
+    stats.sort_stats('cumulative').print_stats(40)
+    _request_profiles[tag] = {
+        "tag": tag,
+        "path": path,
+        "elapsed_ms": round(elapsed * 1000, 3),
+        "stats_text": text.getvalue(),
+        "stats": profiler,
+    }
+    _request_profiles.move_to_end(tag)
+    while len(_request_profiles) > PROFILING_KEEP_RESULTS:
+        _request_profiles.popitem(last=False)
+    print(f"[DEBUG] Stored cProfile for request tag {tag} ({path}, {elapsed * 1000:.1f} ms)")
+
+
+def get_request_profile(tag: str) -> Dict[str, Any]:
+    entry = _request_profiles.get(tag)
+    if entry is None:
+        raise HTTPException(status_code=404, detail=f"No profile recorded for tag {tag}")
+    return entry
+
+
+def dump_request_profile(tag: str) -> bytes:
+    """Binary pstats dump, loadable with pstats/snakeviz."""
+    profiler = get_request_profile(tag)["stats"]
+    profiler.create_stats()
+    return marshal.dumps(profiler.stats)
@@ -0,0 +1,131 @@
+#!/usr/bin/env python3
+"""
+Replay captured traffic against a local backend.
+
+Start the backend with upstream responses served from the same traces:
+    TRACE_REPLAY=traces/ uvicorn app:app --port 8000
+
+Then drive it at the recorded pace (1x), faster (e.g. 4x) or as fast as possible:
+    python replay_traces.py traces/ --speed 1
+    python replay_traces.py traces/ --speed 4
+    python replay_traces.py traces/ --speed max --concurrency 16
+
+Requests keep their original inter-arrival gaps (scaled by --speed) and are
+tagged with X-Trace-Replay-Id so no call leaves the machine. A latency summary
+is printed per endpoint alongside the latency recorded in production.
+"""
+from typing import Any, Dict, List, Optional
+import argparse
+import json
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+import requests
+from traffic_capture import REPLAY_HEADER, read_traces
+
+
+def percentile(values: List[float], pct: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    k = min(len(ordered) - 1, max(0, int(round(pct / 100 * (len(ordered) - 1)))))
+    return ordered[k]
+
+
+def send(target: str, record: Dict[str, Any], timeout: float) -> Dict[str, Any]:
+    """Send one recorded request and return its measured outcome."""
+    start = time.perf_counter()
+    error = None
+    status = 0
+    try:
+        resp = requests.post(
+            target.rstrip('/') + record['endpoint'],
+            json=record['request'],
+            headers={REPLAY_HEADER: record['id']},
+            timeout=timeout,
+        )
+        status = resp.status_code
+        if record.get('response') is not None and resp.ok and resp.json() != record['response']:
+            error = 'response differs from trace'
+    except Exception as e:
+        error = f"{type(e).__name__}: {e}"
+    return {
+        "endpoint": record['endpoint'],
+        "status": status,
+        "error": error,
+        "latency_ms": (time.perf_counter() - start) * 1000,
+        "recorded_ms": record.get('duration_ms', 0.0),
+    }
+
+
+def replay(records: List[Dict[str, Any]], target: str, speed: Optional[float], concurrency: int, timeout: float) -> List[Dict[str, Any]]:
+    """Replay records in timestamp order. speed=None replays as fast as possible."""
+    records = sorted(records, key=lambda r: r['ts'])
+    results: List[Dict[str, Any]] = []
+    lock = threading.Lock()
+
+    def run(record: Dict[str, Any]) -> None:
+        outcome = send(target, record, timeout)
+        with lock:
+            results.append(outcome)
+
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        t0 = records[0]['ts'] if records else 0.0
+        start = time.perf_counter()
+        for record in records:
+            if speed:
+                delay = (record['ts'] - t0) / speed - (time.perf_counter() - start)
+                if delay > 0:
+                    time.sleep(delay)
+            pool.submit(run, record)
+    return results
+
+
+def summarize(results: List[Dict[str, Any]], elapsed: float) -> None:
+    print(f"Replayed {len(results)} requests in {elapsed:.2f}s")
+    for endpoint in sorted({r['endpoint'] for r in results}):
+        rows = [r for r in results if r['endpoint'] == endpoint]
+        latencies = [r['latency_ms'] for r in rows]
+        recorded = [r['recorded_ms'] for r in rows]
+        errors = [r for r in rows if r['error'] or r['status'] != 200]
+        print(f"\n{endpoint}: {len(rows)} requests, {len(errors)} errors/mismatches")
+        for pct in (50, 95, 99):
+            print(f"  p{pct}: replay {percentile(latencies, pct):8.1f} ms   recorded {percentile(recorded, pct):8.1f} ms")
+        print(f"  max: replay {max(latencies):8.1f} ms   recorded {max(recorded):8.1f} ms")
+        for r in errors[:5]:
+            print(f"  ! status={r['status']} {r['error'] or ''}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Replay captured backend traffic")
+    parser.add_argument('traces', help="trace file (.jsonl.gz) or directory of trace files")
+    parser.add_argument('--target', default='http://127.0.0.1:8000', help="backend base URL")
+    parser.add_argument('--speed', default='1', help="time scale: 1 = real time, 4 = 4x faster, max = no delays")
+    parser.add_argument('--concurrency', type=int, default=32, help="maximum in-flight requests")
+    parser.add_argument('--endpoint', action='append', help="only replay this endpoint (repeatable)")
+    parser.add_argument('--limit', type=int, help="replay at most this many records")
+    parser.add_argument('--timeout', type=float, default=120, help="per-request timeout in seconds")
+    parser.add_argument('--json', dest='json_out', help="write per-request results to this file")
+    args = parser.parse_args()
+
+    speed = None if args.speed == 'max' else float(args.speed)
+    records = [r for r in read_traces(args.traces) if not args.endpoint or r['endpoint'] in args.endpoint]
+    if args.limit:
+        records = sorted(records, key=lambda r: r['ts'])[:args.limit]
+    if not records:
+        print("No trace records found")
+        return
+
+    pace = 'max speed' if speed is None else f"{args.speed}x"
+    print(f"Replaying {len(records)} requests against {args.target} at {pace}")
+    start = time.perf_counter()
+    results = replay(records, args.target, speed, args.concurrency, args.timeout)
+    summarize(results, time.perf_counter() - start)
+
+    if args.json_out:
+        with open(args.json_out, 'w') as fh:
+            json.dump(results, fh, indent=2)
+
+
+if __name__ == "__main__":
+    main()
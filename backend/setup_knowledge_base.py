@@ -1,12 +1,16 @@
 """
-Script to set up the FAU knowledge base using the knowledge base API endpoints.
-Run this once to create and populate your knowledge base with FAU website content.
+Script to set up a knowledge base using the knowledge base API endpoints.
+Run this once per knowledge pack to create and populate its knowledge base with
+the pack's website content:
+    python setup_knowledge_base.py [pack_id]
 """
 import os
+import sys
 import json
 import requests
 from typing import List
 from dotenv import load_dotenv
+import knowledge_packs
 
 # Load environment variables from .env file
 load_dotenv()
@@ -14,22 +18,12 @@ load_dotenv()
 # Configuration
 KB_API_URL = os.environ.get('KB_API_URL', 'https://chat.hpc.fau.edu')
 KB_API_KEY = os.environ.get('KB_API_KEY')
-KB_NAME = "fau_kb"
-KB_DESCRIPTION = "All FAU website content for student guidance"
 
-# FAU URLs to add to knowledge base
-FAU_URLS = [
-    "https://www.fau.edu/registrar/forms/",
-    "https://www.fau.edu/registrar/registration/",
-    "https://www.fau.edu/registrar/",
-    "https://www.fau.edu/financialaid/",
-    "https://www.fau.edu/financialaid/apply/",
-    "https://www.fau.edu/admissions/",
-    "https://www.fau.edu/student-services/",
-    "https://www.fau.edu/academics/",
-    "https://www.fau.edu/bursar/",
-    "https://www.fau.edu/housing/",
-]
+# Knowledge base name, description and URLs come from the knowledge pack
+PACK = knowledge_packs.get_pack(sys.argv[1] if len(sys.argv) > 1 else None)
+KB_NAME = PACK.knowledge_base["name"]
+KB_DESCRIPTION = PACK.knowledge_base["description"]
+KB_URLS = list(PACK.knowledge_base["urls"].values())
 
 def make_api_request(endpoint: str, method: str = "POST", data: dict = None) -> dict:
     """Make API request to knowledge base."""
@@ -99,7 +93,7 @@ def test_query(collection_name: str = None):
     
     data = {
         "collection_names": [collection_name],
-        "query": "How do I register for classes at FAU?",
+        "query": PACK.knowledge_base.get("test_query", f"How do I register for classes at {PACK.name}?"),
         "k": 5
     }
     
@@ -119,7 +113,7 @@ def main():
         knowledge_id = create_knowledge_base()
         
         # Step 2: Process URLs individually
-        process_urls_individually(FAU_URLS, KB_NAME)
+        process_urls_individually(KB_URLS, KB_NAME)
         
         # Step 3: Reindex (optional)
         try:
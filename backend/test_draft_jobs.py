@@ -0,0 +1,112 @@
+#!/usr/bin/env python3
+"""
+Load test for draft jobs: dedupe of concurrent submits, the pending-queue
+cap, and failure handling end to end through the /draft-reply/jobs API
+against a local fake upstream. Run directly or with pytest:
+
+    python test_draft_jobs.py
+"""
+
+import asyncio
+import os
+import threading
+import time
+
+from fastapi.testclient import TestClient
+
+import app
+import draft_jobs
+from fake_upstream import FakeUpstream
+
+
+def test_concurrent_submits_deduplicate():
+    """40 concurrent submits of 5 distinct drafts run 5 jobs."""
+    runs = []
+    lock = threading.Lock()
+
+    def run(payload):
+        with lock:
+            runs.append(payload)
+        time.sleep(0.05)
+        return {"reply": f"re: {payload}"}
+
+    async def main():
+        store = draft_jobs.DraftJobStore(run, workers=4)
+        submitted = await asyncio.gather(*(store.submit(f"key-{i % 5}", f"email {i % 5}") for i in range(40)))
+        jobs = {job.id: job for job, _ in submitted}
+        await asyncio.gather(*(store.wait(job, 5) for job in jobs.values()))
+        return store, jobs, sum(created for _, created in submitted)
+
+    store, jobs, created = asyncio.run(main())
+    assert created == 5 and len(jobs) == 5 and len(runs) == 5, (created, len(jobs), runs)
+    assert all(j.status == draft_jobs.DONE for j in jobs.values())
+    assert sorted(j.result['reply'] for j in jobs.values()) == [f"re: email {i}" for i in range(5)]
+    assert store.stats()['counters']['deduplicated'] == 35
+    print("✅ 40 concurrent submits -> 5 jobs")
+
+
+def test_pending_cap():
+    release = threading.Event()
+
+    async def main():
+        store = draft_jobs.DraftJobStore(lambda payload: release.wait(5) and {"reply": "ok"}, workers=1, max_pending=2)
+        jobs = [(await store.submit(f"key-{i}", i))[0] for i in range(3)]  # 1 running + 2 queued
+        await asyncio.sleep(0.1)
+        try:
+            await store.submit("key-overflow", "overflow")
+            rejected = False
+        except draft_jobs.QueueFullError:
+            rejected = True
+        release.set()
+        await asyncio.gather(*(store.wait(job, 5) for job in jobs))
+        return rejected, jobs
+
+    rejected, jobs = asyncio.run(main())
+    assert rejected, "submit beyond DRAFT_MAX_PENDING was accepted"
+    assert all(job.status == draft_jobs.DONE for job in jobs)
+    print("✅ submits beyond the pending cap are rejected")
+
+
+def test_failed_draft_is_retried_after_recovery():
+    """An upstream failure marks the job failed; resubmitting once upstream is back drafts for real."""
+    state = {"up": False}
+
+    def reply(payload):
+        if not state["up"]:
+            raise RuntimeError("upstream unavailable")
+        return "Dear Dr. Smith, thank you."
+
+    body = {"emailText": f"Can you send the form? {time.time()}", "userInstructions": ""}
+    saved = os.environ.get('FAU_API_URL')
+    with FakeUpstream(reply) as upstream, TestClient(app.app) as client:
+        os.environ['FAU_API_URL'] = upstream.url
+        try:
+            job = client.post('/draft-reply/jobs', json=body).json()
+            job = client.get(f"/draft-reply/jobs/{job['job_id']}?wait=10").json()
+            assert job['status'] == draft_jobs.FAILED, job
+            assert 'reply' not in job, job
+
+            state["up"] = True
+            retry = client.post('/draft-reply/jobs', json=body).json()
+            assert retry['job_id'] != job['job_id'], "resubmit reused the failed job"
+            retry = client.get(f"/draft-reply/jobs/{retry['job_id']}?wait=10").json()
+            assert retry['status'] == draft_jobs.DONE and retry['reply'] == "Dear Dr. Smith, thank you.", retry
+
+            # The synchronous endpoint still answers with the canned reply when upstream fails
+            state["up"] = False
+            sync = client.post('/draft-reply', json=body).json()
+            assert sync['reply'].startswith("Thank you for your email."), sync
+        finally:
+            if saved is None:
+                os.environ.pop('FAU_API_URL', None)
+            else:
+                os.environ['FAU_API_URL'] = saved
+    print("✅ failed draft job is marked failed and retried on resubmit")
+
+
+if __name__ == "__main__":
+    print("\n🚀 Draft job load tests\n")
+    test_concurrent_submits_deduplicate()
+    test_pending_cap()
+    test_failed_draft_is_retried_after_recovery()
+    print("\n✨ Tests complete!\n")
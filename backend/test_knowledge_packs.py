@@ -0,0 +1,152 @@
+#!/usr/bin/env python3
+"""
+Load test for the knowledge pack cache: concurrent cold loads, concurrent
+recompiles and LRU eviction, against throwaway copies of packs/fau.json,
+plus how /orchestrate handles unknown and broken packs. No running backend or
+upstream needed. Run directly or with pytest:
+
+    python test_knowledge_packs.py
+"""
+
+import collections
+import contextlib
+import json
+import pathlib
+import random
+import shutil
+import tempfile
+import threading
+
+import knowledge_packs
+
+SOURCE = pathlib.Path(__file__).resolve().parent / 'packs' / 'fau.json'
+
+
+@contextlib.contextmanager
+def _use_packs_dir(pack_ids, max_entries=16):
+    """
+    Point knowledge_packs at a fresh directory holding copies of fau.json under
+    the given ids, with an empty cache. Restores the real packs afterwards.
+    """
+    saved = (knowledge_packs.PACKS_DIR, knowledge_packs.COMPILED_DIR, knowledge_packs.PACK_CACHE_MAX_ENTRIES,
+             collections.OrderedDict(knowledge_packs._cache), knowledge_packs._cache_bytes,
+             dict(knowledge_packs._load_locks))
+    directory = pathlib.Path(tempfile.mkdtemp(prefix='packs-'))
+    source = json.loads(SOURCE.read_text(encoding='utf-8'))
+    for pack_id in pack_ids:
+        source['id'] = pack_id
+        source['default_guide'] = dict(source['default_guide'], summary=f"{pack_id} guidance for: {{query}}")
+        (directory / f"{pack_id}.json").write_text(json.dumps(source), encoding='utf-8')
+    knowledge_packs.PACKS_DIR = directory
+    knowledge_packs.COMPILED_DIR = directory / '.compiled'
+    knowledge_packs.PACK_CACHE_MAX_ENTRIES = max_entries
+    knowledge_packs._cache.clear()
+    knowledge_packs._cache_bytes = 0
+    knowledge_packs._load_locks.clear()
+    try:
+        yield directory
+    finally:
+        (knowledge_packs.PACKS_DIR, knowledge_packs.COMPILED_DIR, knowledge_packs.PACK_CACHE_MAX_ENTRIES,
+         cache, knowledge_packs._cache_bytes, locks) = saved
+        knowledge_packs._cache.clear()
+        knowledge_packs._cache.update(cache)
+        knowledge_packs._load_locks.clear()
+        knowledge_packs._load_locks.update(locks)
+        shutil.rmtree(directory)
+
+
+def _run_threads(n, target):
+    """Start n threads on target(i) behind a barrier; return the exceptions they raised."""
+    barrier = threading.Barrier(n)
+    errors = []
+
+    def run(i):
+        barrier.wait()
+        try:
+            target(i)
+        except Exception as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=run, args=(i,)) for i in range(n)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    return errors
+
+
+def test_concurrent_cold_load():
+    """16 threads asking for the same uncompiled pack get one shared instance."""
+    for attempt in range(5):
+        with _use_packs_dir(['fau']):
+            packs = []
+            errors = _run_threads(16, lambda i: packs.append(knowledge_packs.get_pack('fau')))
+            assert not errors, errors
+            assert len(packs) == 16 and all(p is packs[0] for p in packs)
+            assert not list(knowledge_packs.COMPILED_DIR.glob('*.tmp'))
+    print("✅ concurrent cold load: one compile, one instance, no temp files left")
+
+
+def test_concurrent_recompile():
+    """Forced recompiles racing each other (as separate workers would) all succeed."""
+    with _use_packs_dir(['fau']):
+        errors = _run_threads(16, lambda i: knowledge_packs.compile_pack('fau', force=True))
+        assert not errors, errors
+        assert not list(knowledge_packs.COMPILED_DIR.glob('*.tmp'))
+        assert knowledge_packs.load_pack('fau').id == 'fau'
+    print("✅ concurrent recompile: no lost temp files")
+
+
+def test_lru_eviction_under_load():
+    """Random access to 8 packs with room for 3 keeps the cache bounded and its byte count exact."""
+    pack_ids = [f"tenant{i}" for i in range(8)]
+    with _use_packs_dir(pack_ids, max_entries=3):
+        def hammer(i):
+            rng = random.Random(i)
+            for _ in range(50):
+                pack_id = rng.choice(pack_ids)
+                assert knowledge_packs.get_pack(pack_id).id == pack_id
+
+        errors = _run_threads(8, hammer)
+        assert not errors, errors
+        info = knowledge_packs.cache_info()
+        assert len(info['packs']) <= 3, info
+        assert info['bytes'] == sum(p.size for p in knowledge_packs._cache.values()), info
+    print("✅ LRU eviction under load: cache stays within 3 packs")
+
+
+def test_fallback_uses_requested_pack():
+    """Error fallbacks come from the requested pack, and are institution-neutral if it is missing."""
+    from langgraph_orchestrator import get_pack_fallback_steps
+
+    with _use_packs_dir(['fau', 'tenant']):
+        assert get_pack_fallback_steps('xyz', 'tenant')['summary'] == 'tenant guidance for: xyz'
+        neutral = get_pack_fallback_steps('xyz', 'missing')
+        assert 'FAU' not in json.dumps(neutral), neutral
+    print("✅ fallback steps follow the requested pack")
+
+
+def test_orchestrate_rejects_unknown_and_survives_broken_packs():
+    """Unknown pack ids are a 400; a pack that fails to compile gets neutral fallback steps, not a 500."""
+    from fastapi.testclient import TestClient
+    import app
+
+    with _use_packs_dir(['fau']) as directory, TestClient(app.app) as client:
+        (directory / 'broken.json').write_text('{"id": "broken", ', encoding='utf-8')
+        (directory / 'renamed.json').write_text(json.dumps({"id": "other"}), encoding='utf-8')
+        assert client.post('/orchestrate', json={"message": "hi", "pack": "nope"}).status_code == 400
+        for pack_id in ('broken', 'renamed'):
+            resp = client.post('/orchestrate', json={"message": "hi", "pack": pack_id})
+            assert resp.status_code == 200, (pack_id, resp.status_code)
+            assert resp.json()['summary'] == 'General guidance for: hi', resp.json()
+    print("✅ /orchestrate: unknown pack -> 400, broken pack -> neutral fallback")
+
+
+if __name__ == "__main__":
+    print("\n🚀 Knowledge pack load tests\n")
+    test_concurrent_cold_load()
+    test_concurrent_recompile()
+    test_lru_eviction_under_load()
+    test_fallback_uses_requested_pack()
+    test_orchestrate_rejects_unknown_and_survives_broken_packs()
+    print("\n✨ Tests complete!\n")
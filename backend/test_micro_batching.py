@@ -0,0 +1,145 @@
+#!/usr/bin/env python3
+"""
+Load test for micro-batching: leader/follower hand-off, dedupe, size caps and
+fallbacks under concurrent submits, plus an end-to-end run of concurrent
+orchestrate() calls against a local fake upstream. Run directly or with pytest:
+
+    python test_micro_batching.py
+"""
+
+import json
+import threading
+
+import langgraph_orchestrator
+import micro_batching
+from fake_upstream import FakeUpstream, steps_json
+
+
+def _submit_concurrently(batcher, queries, group='fau'):
+    """Submit every query from its own thread at the same moment; return {index: result}."""
+    barrier = threading.Barrier(len(queries))
+    results = {}
+
+    def run(i, query):
+        barrier.wait()
+        results[i] = batcher.submit(group, query, None)
+
+    threads = [threading.Thread(target=run, args=(i, q)) for i, q in enumerate(queries)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    return results
+
+
+class _RecordingBatch:
+    """call_batch stand-in that answers every query and remembers the batches it saw."""
+
+    def __init__(self, fail=False, skip=()):
+        self.batches = []
+        self.fail = fail
+        self.skip = set(skip)
+        self._lock = threading.Lock()
+
+    def __call__(self, context, queries):
+        with self._lock:
+            self.batches.append(dict(queries))
+        if self.fail:
+            raise RuntimeError("upstream down")
+        return {qid: f"answer:{q}" for qid, q in queries.items() if q not in self.skip}
+
+
+def test_concurrent_queries_share_one_call():
+    call = _RecordingBatch()
+    batcher = micro_batching.MicroBatcher(call, window=0.5, max_size=8)
+    queries = [f"question {i}" for i in range(8)]
+    results = _submit_concurrently(batcher, queries)
+    assert len(call.batches) == 1, call.batches
+    assert all(results[i] == f"answer:{q}" for i, q in enumerate(queries)), results
+    assert batcher.stats()['upstream_calls_saved'] == 7
+    print("✅ 8 concurrent queries answered by 1 upstream call")
+
+
+def test_duplicates_and_size_cap():
+    call = _RecordingBatch()
+    batcher = micro_batching.MicroBatcher(call, window=0.5, max_size=4)
+    queries = [f"question {i % 10}" for i in range(20)]  # 10 distinct, each asked twice
+    results = _submit_concurrently(batcher, queries)
+    assert all(len(b) <= 4 for b in call.batches), call.batches
+    assert all(results[i] in (f"answer:{q}", None) for i, q in enumerate(queries)), results
+    # A duplicate arriving after its batch closed opens a new one, which may end up a
+    # singleton that never reaches call_batch; every query is either batched or falls back
+    asked = {q for b in call.batches for q in b.values()}
+    for query in set(queries):
+        answers = [results[i] for i, q in enumerate(queries) if q == query]
+        if query in asked:
+            assert f"answer:{query}" in answers, (query, answers)
+        else:
+            assert answers == [None] * len(answers), (query, answers)
+    print(f"✅ 20 submits (10 distinct) -> {len(call.batches)} batches of at most 4")
+
+
+def test_failed_batch_falls_back():
+    call = _RecordingBatch(fail=True)
+    batcher = micro_batching.MicroBatcher(call, window=0.5, max_size=8)
+    results = _submit_concurrently(batcher, [f"question {i}" for i in range(5)])
+    assert len(call.batches) == 1
+    assert all(r is None for r in results.values()), results
+    assert batcher.stats()['counters']['failed_batches'] == 1
+    print("✅ failed batch hands every query back for an individual call")
+
+
+def test_missing_answer_falls_back():
+    call = _RecordingBatch(skip={'question 2'})
+    batcher = micro_batching.MicroBatcher(call, window=0.5, max_size=8)
+    queries = [f"question {i}" for i in range(4)]
+    results = _submit_concurrently(batcher, queries)
+    assert results[2] is None and results[0] == "answer:question 0", results
+    print("✅ query missing from the batched answer falls back on its own")
+
+
+def test_orchestrate_end_to_end():
+    """Concurrent orchestrate() calls with BATCH_ENABLED share a call to the fake upstream."""
+
+    def reply(payload):
+        prompt = payload['messages'][-1]['content']
+        if 'for each of these requests' in prompt:
+            queries = json.loads(prompt.split('\n', 1)[1])
+            return json.dumps({qid: json.loads(steps_json(q)) for qid, q in queries.items()})
+        return steps_json(prompt)
+
+    saved = (micro_batching.BATCH_ENABLED, langgraph_orchestrator.FAU_API_URL, langgraph_orchestrator.batcher)
+    with FakeUpstream(reply, delay=0.05) as upstream:
+        micro_batching.BATCH_ENABLED = True
+        langgraph_orchestrator.FAU_API_URL = upstream.url
+        langgraph_orchestrator.batcher = micro_batching.MicroBatcher(langgraph_orchestrator.call_llm_batch, window=0.5)
+        try:
+            queries = [f"How do I do task number {i}?" for i in range(6)]
+            barrier = threading.Barrier(len(queries))
+            results = {}
+
+            def run(i):
+                barrier.wait()
+                results[i] = langgraph_orchestrator.orchestrate(queries[i])
+
+            threads = [threading.Thread(target=run, args=(i,)) for i in range(len(queries))]
+            for t in threads:
+                t.start()
+            for t in threads:
+                t.join()
+        finally:
+            micro_batching.BATCH_ENABLED, langgraph_orchestrator.FAU_API_URL, langgraph_orchestrator.batcher = saved
+
+    assert len(upstream.calls) == 1, f"{len(upstream.calls)} upstream calls"
+    assert all(results[i]['summary'] == q for i, q in enumerate(queries)), results
+    print("✅ 6 concurrent orchestrate() calls -> 1 upstream call")
+
+
+if __name__ == "__main__":
+    print("\n🚀 Micro-batching load tests\n")
+    test_concurrent_queries_share_one_call()
+    test_duplicates_and_size_cap()
+    test_failed_batch_falls_back()
+    test_missing_answer_falls_back()
+    test_orchestrate_end_to_end()
+    print("\n✨ Tests complete!\n")
@@ -0,0 +1,206 @@
+#!/usr/bin/env python3
+"""
+Tests for the model router: eligibility (ROUTER_MIN_SAMPLES, quality floor,
+error rate), picking the fastest eligible model, falling back to the default,
+Route bookkeeping, and that prefetched or batched orchestrate answers record
+no decision or sample. The router settings are pinned, with exploration
+switched off (ROUTER_EXPLORE=0), so every choice is deterministic. Run
+directly or with pytest:
+
+    python test_model_router.py
+"""
+
+import contextlib
+import json
+import threading
+import time
+
+import langgraph_orchestrator
+import micro_batching
+import model_router
+import prefetch
+from fake_upstream import FakeUpstream, steps_json
+
+
+_SETTINGS = {'ROUTER_EXPLORE': 0.0, 'ROUTER_MIN_SAMPLES': 10, 'ROUTER_QUALITY_FLOOR': 0.9,
+             'ROUTER_MAX_ERROR_RATE': 0.1}
+
+
+@contextlib.contextmanager
+def _pinned_settings():
+    saved = {name: getattr(model_router, name) for name in _SETTINGS}
+    for name, value in _SETTINGS.items():
+        setattr(model_router, name, value)
+    try:
+        yield
+    finally:
+        for name, value in saved.items():
+            setattr(model_router, name, value)
+
+
+def _feed(router, model, latency_ms, n=10, errors=0, invalid=0):
+    """Record n orchestrate/simple outcomes for model: the first `errors` fail, the next `invalid` are invalid."""
+    for i in range(n):
+        route = model_router.Route(router, 'orchestrate', model_router.SIMPLE, model, 'test')
+        if i < errors:
+            route.fail(latency_ms)
+        else:
+            route.complete(latency_ms)
+            route.validate(i >= errors + invalid)
+
+
+def _choose(router):
+    return router.choose('orchestrate', model_router.SIMPLE)
+
+
+def _decisions(router):
+    return sum(d['count'] for d in router.stats()['decisions'])
+
+
+def _samples(router):
+    return sum(m['samples'] for m in router.stats()['per_model'])
+
+
+def test_default_until_enough_samples():
+    with _pinned_settings():
+        router = model_router.ModelRouter(['slow', 'fast'], 'slow')
+        assert (_choose(router).model, _choose(router).reason) == ('slow', 'default')
+        _feed(router, 'fast', 100, n=9)
+        assert _choose(router).model == 'slow', "chose a model with too few samples"
+        _feed(router, 'fast', 100, n=1)
+        route = _choose(router)
+        assert (route.model, route.reason) == ('fast', 'fastest'), (route.model, route.reason)
+    print("✅ default model until a candidate has ROUTER_MIN_SAMPLES samples")
+
+
+def test_fastest_eligible_model_wins():
+    with _pinned_settings():
+        router = model_router.ModelRouter(['slow', 'fast'], 'slow')
+        _feed(router, 'slow', 800)
+        _feed(router, 'fast', 120)
+        assert _choose(router).model == 'fast'
+        # The default gets no preference once another model is measurably faster
+        router = model_router.ModelRouter(['fast', 'slow'], 'slow')
+        _feed(router, 'fast', 120)
+        _feed(router, 'slow', 800)
+        assert _choose(router).model == 'fast'
+    print("✅ a slow model is not chosen over a faster eligible one")
+
+
+def test_quality_floor_and_error_rate_exclude():
+    with _pinned_settings():
+        router = model_router.ModelRouter(['slow', 'fast'], 'slow')
+        _feed(router, 'slow', 800, n=20)
+        _feed(router, 'fast', 120, n=20, invalid=3)  # 85% valid, floor is 90%
+        route = _choose(router)
+        assert (route.model, route.reason) == ('slow', 'fastest'), "model below the quality floor was chosen"
+
+        router = model_router.ModelRouter(['slow', 'fast'], 'slow')
+        _feed(router, 'slow', 800, n=20)
+        _feed(router, 'fast', 120, n=20, errors=3)  # 15% errors, limit is 10%
+        assert _choose(router).model == 'slow', "model above the error rate was chosen"
+        eligible = {m['model']: m['eligible'] for m in router.stats()['per_model']}
+        assert eligible == {'slow': True, 'fast': False}, eligible
+    print("✅ models below the quality floor or above the error rate are excluded")
+
+
+def test_route_bookkeeping():
+    router = model_router.ModelRouter(['a', 'b'], 'a')
+
+    route = model_router.Route(router, 'orchestrate', model_router.SIMPLE, 'b', 'test')
+    assert route.begin() == 'b' and route.begin() == 'b'
+    assert _decisions(router) == 1, "begin() counted the decision twice"
+    route.complete(50)
+    route.validate(True)
+    route.validate(True)
+    assert _samples(router) == 1, "validate() recorded twice"
+
+    # Chosen but never sent upstream (answer came from elsewhere): no decision, no sample
+    route = _choose(router)
+    route.validate(True)
+    assert (_decisions(router), _samples(router)) == (1, 1)
+
+    # A failed call is one error sample; a later validate() does not add another
+    route = model_router.Route(router, 'orchestrate', model_router.SIMPLE, 'b', 'test')
+    route.begin()
+    route.fail(30)
+    route.validate(False)
+    stats = {m['model']: m for m in router.stats()['per_model']}['b']
+    assert stats['samples'] == 2 and stats['error_rate'] == 0.5, stats
+    assert stats['latency_ms']['p50'] == 50, "a failed call's latency was counted"
+    print("✅ begin/complete/validate/fail record one decision and one sample per call")
+
+
+def test_prefetched_and_batched_answers_bypass_routing():
+    """Answers from the prefetch cache or a shared batched call record no decision or sample."""
+
+    def reply(payload):
+        prompt = payload['messages'][-1]['content']
+        if 'for each of these requests' in prompt:
+            queries = json.loads(prompt.split('\n', 1)[1])
+            return json.dumps({qid: json.loads(steps_json(q)) for qid, q in queries.items()})
+        return steps_json(prompt)
+
+    router = model_router.ModelRouter([model_router.FAU_MODEL, 'other-model'], model_router.FAU_MODEL)
+    saved = (model_router._router, micro_batching.BATCH_ENABLED, langgraph_orchestrator.FAU_API_URL,
+             langgraph_orchestrator.batcher, langgraph_orchestrator.prefetcher)
+    with _pinned_settings(), FakeUpstream(reply, delay=0.05) as upstream:
+        model_router._router = router
+        langgraph_orchestrator.FAU_API_URL = upstream.url
+        try:
+            # Prefetch: the background generation and the served answer bypass routing
+            prefetcher = langgraph_orchestrator.prefetcher = prefetch.Prefetcher(langgraph_orchestrator.prefetch_guide)
+            for i in range(prefetch.PREFETCH_MIN_COUNT):
+                prefetcher.observe(f"client-{i}", 'fau', "How do I apply for housing?")
+                prefetcher.observe(f"client-{i}", 'fau', "How do I get a parking permit?")
+            prefetcher.observe("new-student", 'fau', "How do I apply for housing?")
+            deadline = time.time() + 5
+            while not prefetcher.stats()['counters'].get('stored') and time.time() < deadline:
+                time.sleep(0.02)
+            langgraph_orchestrator.orchestrate("How do I get a parking permit?")
+            assert prefetcher.stats()['counters'].get('hits') == 1, prefetcher.stats()
+            assert (_decisions(router), _samples(router)) == (0, 0), router.stats()
+            langgraph_orchestrator.prefetcher = None
+
+            # Batching: only queries that end up making their own call are routed
+            micro_batching.BATCH_ENABLED = True
+            langgraph_orchestrator.batcher = micro_batching.MicroBatcher(langgraph_orchestrator.call_llm_batch, window=0.5)
+            calls_before = len(upstream.calls)
+            queries = [f"How do I do task number {i}?" for i in range(6)]
+            barrier = threading.Barrier(len(queries))
+
+            def run(i):
+                barrier.wait()
+                langgraph_orchestrator.orchestrate(queries[i])
+
+            threads = [threading.Thread(target=run, args=(i,)) for i in range(len(queries))]
+            for t in threads:
+                t.start()
+            for t in threads:
+                t.join()
+            batched_decisions, batched_samples = _decisions(router), _samples(router)
+
+            # Control: an ordinary call is routed, so the counts above are not vacuous
+            micro_batching.BATCH_ENABLED = False
+            langgraph_orchestrator.orchestrate("How do I reset my password?")
+        finally:
+            (model_router._router, micro_batching.BATCH_ENABLED, langgraph_orchestrator.FAU_API_URL,
+             langgraph_orchestrator.batcher, langgraph_orchestrator.prefetcher) = saved
+
+    prompts = [c['messages'][-1]['content'] for c in upstream.calls[calls_before:-1]]
+    batched = [p for p in prompts if 'for each of these requests' in p]
+    assert batched, "no batched upstream call was made"
+    own_calls = len(prompts) - len(batched)
+    assert (batched_decisions, batched_samples) == (own_calls, own_calls), (own_calls, router.stats())
+    assert (_decisions(router), _samples(router)) == (own_calls + 1, own_calls + 1), router.stats()
+    print(f"✅ prefetched and batched answers bypass routing ({own_calls} routed of {len(queries)})")
+
+
+if __name__ == "__main__":
+    print("\n🚀 Model router tests\n")
+    test_default_until_enough_samples()
+    test_fastest_eligible_model_wins()
+    test_quality_floor_and_error_rate_exclude()
+    test_route_bookkeeping()
+    test_prefetched_and_batched_answers_bypass_routing()
+    print("\n✨ Tests complete!\n")
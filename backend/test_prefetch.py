@@ -0,0 +1,133 @@
+#!/usr/bin/env python3
+"""
+Load test for predictive prefetch: transition learning from concurrent
+clients, deferral while upstream is busy, and an end-to-end orchestrate()
+answered from the prefetch cache of a local fake upstream. Run directly or
+with pytest:
+
+    python test_prefetch.py
+"""
+
+import threading
+import time
+
+import langgraph_orchestrator
+import prefetch
+import traffic_capture
+from fake_upstream import FakeUpstream, steps_json
+
+
+class _CountingGenerate:
+    """generate() stand-in that answers with the query text and counts calls per query."""
+
+    def __init__(self):
+        self.calls = []
+        self._lock = threading.Lock()
+
+    def __call__(self, pack, query):
+        with self._lock:
+            self.calls.append(query)
+        return f"answer:{query}"
+
+
+def _wait_for(predicate, timeout=5.0):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        if predicate():
+            return True
+        time.sleep(0.02)
+    return False
+
+
+def _teach(prefetcher, first, second, clients=prefetch.PREFETCH_MIN_COUNT):
+    """
+    Have `clients` distinct clients ask `first` and then `second`, all at once.
+    With the default of PREFETCH_MIN_COUNT clients nothing is prefetched yet.
+    """
+    barrier = threading.Barrier(clients)
+
+    def run(i):
+        barrier.wait()
+        prefetcher.observe(f"client-{i}", 'fau', first)
+        prefetcher.observe(f"client-{i}", 'fau', second)
+
+    threads = [threading.Thread(target=run, args=(i,)) for i in range(clients)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+
+def test_concurrent_clients_teach_one_prefetch():
+    generate = _CountingGenerate()
+    prefetcher = prefetch.Prefetcher(generate)
+    _teach(prefetcher, "How do I register?", "How do I pay tuition?")
+
+    # Twenty more students ask the first question at once: the follow-up is generated once
+    barrier = threading.Barrier(20)
+
+    def ask(i):
+        barrier.wait()
+        prefetcher.observe(f"student-{i}", 'fau', "how do I  register?")
+
+    threads = [threading.Thread(target=ask, args=(i,)) for i in range(20)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+    assert _wait_for(lambda: prefetcher.stats()['counters'].get('stored', 0) >= 1)
+    time.sleep(0.2)
+    assert generate.calls.count("How do I pay tuition?") == 1, generate.calls
+    assert prefetcher.lookup('fau', "how do i pay tuition?") == "answer:How do I pay tuition?"
+    assert prefetcher.lookup('fau', "how do i pay tuition?") is None  # consumed
+    print(f"✅ 26 concurrent observes -> {len(generate.calls)} prefetch call, served once")
+
+
+def test_waits_for_idle_upstream():
+    generate = _CountingGenerate()
+    prefetcher = prefetch.Prefetcher(generate)
+    _teach(prefetcher, "Where is the library?", "When does the library close?")
+
+    saved = prefetch.UPSTREAM_CAPACITY
+    prefetch.UPSTREAM_CAPACITY = 1
+    try:
+        # One interactive call in flight = 100% utilization
+        with traffic_capture._track_inflight():
+            prefetcher.observe("late-student", 'fau', "Where is the library?")
+            time.sleep(0.3)
+            assert not generate.calls, "prefetch ran while upstream was busy"
+        assert _wait_for(lambda: generate.calls)
+    finally:
+        prefetch.UPSTREAM_CAPACITY = saved
+    assert prefetcher.stats()['counters'].get('deferred_busy') == 1
+    print("✅ prefetch deferred while upstream was busy, ran once it was idle")
+
+
+def test_orchestrate_served_from_prefetch():
+    """A learned follow-up is generated against the fake upstream and served without another call."""
+    with FakeUpstream(lambda payload: steps_json(payload['messages'][-1]['content'])) as upstream:
+        saved = (langgraph_orchestrator.FAU_API_URL, langgraph_orchestrator.prefetcher)
+        langgraph_orchestrator.FAU_API_URL = upstream.url
+        prefetcher = langgraph_orchestrator.prefetcher = prefetch.Prefetcher(langgraph_orchestrator.prefetch_guide)
+        try:
+            _teach(prefetcher, "How do I apply for housing?", "How do I get a parking permit?")
+            prefetcher.observe("new-student", 'fau', "How do I apply for housing?")
+            assert _wait_for(lambda: prefetcher.stats()['counters'].get('stored', 0) >= 1)
+            calls_before = len(upstream.calls)
+            result = langgraph_orchestrator.orchestrate("How do I get a parking permit?")
+        finally:
+            langgraph_orchestrator.FAU_API_URL, langgraph_orchestrator.prefetcher = saved
+
+    assert len(upstream.calls) == calls_before, "orchestrate went upstream despite a prefetched answer"
+    assert 'parking permit' in result['summary'], result
+    assert prefetcher.stats()['counters']['hits'] == 1
+    print("✅ orchestrate() answered from the prefetch cache")
+
+
+if __name__ == "__main__":
+    print("\n🚀 Prefetch load tests\n")
+    test_concurrent_clients_teach_one_prefetch()
+    test_waits_for_idle_upstream()
+    test_orchestrate_served_from_prefetch()
+    print("\n✨ Tests complete!\n")
@@ -0,0 +1,160 @@
+#!/usr/bin/env python3
+"""
+Capture/replay round trip: record /orchestrate and /draft-reply traffic
+(including a failed upstream call) against a local fake upstream, read the
+traces back, and replay them with X-Trace-Replay-Id while the upstream is
+unreachable. Also checks trace pruning and truncated trace files. Run
+directly or with pytest:
+
+    python test_traffic_capture.py
+"""
+
+import gzip
+import json
+import os
+import pathlib
+import shutil
+import socket
+import tempfile
+import time
+
+import requests
+from fastapi.testclient import TestClient
+
+import app
+import langgraph_orchestrator
+import traffic_capture
+from fake_upstream import FakeUpstream, steps_json
+
+_PATCHED = ('TRACE_CAPTURE', 'TRACE_DIR', 'TRACE_REPLAY', 'TRACE_REPLAY_LATENCY', '_writer', '_replay_index')
+
+
+def _dead_url():
+    """URL of a local port nothing listens on."""
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        port = s.getsockname()[1]
+    return f"http://127.0.0.1:{port}/chat/completions"
+
+
+def _set_upstream(url):
+    langgraph_orchestrator.FAU_API_URL = url
+    os.environ['FAU_API_URL'] = url
+
+
+def test_capture_and_replay_round_trip():
+    saved = {name: getattr(traffic_capture, name) for name in _PATCHED}
+    saved_url = (langgraph_orchestrator.FAU_API_URL, os.environ.get('FAU_API_URL'))
+    directory = pathlib.Path(tempfile.mkdtemp(prefix='traces-'))
+    requests_sent = [
+        ('/orchestrate', {"message": "How do I register for classes?"}),
+        ('/orchestrate', {"message": "Where do I pay tuition?"}),
+        ('/draft-reply', {"emailText": "Can you send me the form?", "userInstructions": ""}),
+    ]
+    try:
+        traffic_capture.TRACE_CAPTURE = True
+        traffic_capture.TRACE_DIR = directory
+        traffic_capture._writer = None
+        with TestClient(app.app) as client:
+            with FakeUpstream(lambda payload: steps_json(payload['messages'][-1]['content'][:40])) as upstream:
+                _set_upstream(upstream.url)
+                live = [client.post(path, json=body).json() for path, body in requests_sent]
+            # Upstream down: the call fails before any response (recorded with status 0)
+            _set_upstream(_dead_url())
+            live.append(client.post('/orchestrate', json={"message": "How do I add a course?"}).json())
+            traffic_capture._writer.close()
+
+            records = list(traffic_capture.read_traces(str(directory)))
+            assert len(records) == 4, records
+            assert [r['response'] for r in records] == live
+            assert records[-1]['upstream'][0]['status'] == 0, records[-1]['upstream']
+
+            # Replay with the upstream still unreachable: every answer comes from the trace
+            traffic_capture.TRACE_CAPTURE = False
+            traffic_capture.TRACE_REPLAY = str(directory)
+            traffic_capture.TRACE_REPLAY_LATENCY = False
+            traffic_capture._replay_index = None
+            for record in records:
+                replayed = client.post(record['endpoint'], json=record['request'],
+                                       headers={traffic_capture.REPLAY_HEADER: record['id']}).json()
+                assert replayed == record['response'], (record['endpoint'], replayed, record['response'])
+    finally:
+        for name, value in saved.items():
+            setattr(traffic_capture, name, value)
+        langgraph_orchestrator.FAU_API_URL = saved_url[0]
+        if saved_url[1] is None:
+            os.environ.pop('FAU_API_URL', None)
+        else:
+            os.environ['FAU_API_URL'] = saved_url[1]
+        shutil.rmtree(directory)
+    print("✅ captured traffic replays to identical responses, including a failed upstream call")
+
+
+def test_replayed_connection_failure_raises():
+    token = traffic_capture._replay.set([{"url": "x", "status": 0, "body": "ConnectionError: refused", "latency_ms": 1}])
+    try:
+        traffic_capture.upstream_post("x", json={}, headers={}, timeout=1)
+        raised = False
+    except requests.ConnectionError:
+        raised = True
+    finally:
+        traffic_capture._replay.reset(token)
+    assert raised, "status 0 entry did not replay as a connection error"
+    print("✅ status 0 replays as a connection error")
+
+
+def test_truncated_traces_are_readable():
+    directory = pathlib.Path(tempfile.mkdtemp(prefix='traces-'))
+    try:
+        lines = [json.dumps({"id": str(i), "pad": os.urandom(64).hex()}) for i in range(50)]
+        # Partial last line, but a complete gzip stream
+        with gzip.open(directory / 'trace-partial.jsonl.gz', 'wt', encoding='utf-8') as fh:
+            fh.write('\n'.join(lines) + '\n{"id": "cut')
+        # A crash mid-write: the gzip stream itself stops halfway through
+        data = gzip.compress(('\n'.join(lines) + '\n').encode('utf-8'))
+        (directory / 'trace-crashed.jsonl.gz').write_bytes(data[:len(data) // 2])
+        (directory / 'trace-garbage.jsonl.gz').write_bytes(data[:10] + b'\xff' * 200)
+
+        partial = list(traffic_capture.read_traces(str(directory / 'trace-partial.jsonl.gz')))
+        assert [r['id'] for r in partial] == [str(i) for i in range(50)]
+        crashed = list(traffic_capture.read_traces(str(directory / 'trace-crashed.jsonl.gz')))
+        assert 0 < len(crashed) < 50 and crashed[0]['id'] == '0'
+        everything = list(traffic_capture.read_traces(str(directory)))
+        assert len(everything) == len(partial) + len(crashed)
+    finally:
+        shutil.rmtree(directory)
+    print("✅ truncated and corrupt trace files yield their readable records")
+
+
+def test_pruning_spares_live_workers():
+    """Old files from dead processes are pruned; a fresh file from another live worker is kept."""
+    directory = pathlib.Path(tempfile.mkdtemp(prefix='traces-'))
+    try:
+        stale = time.time() - 2 * traffic_capture._TRACE_STALE_SECONDS
+        for i in range(5):
+            path = directory / f"trace-20200101-00000{i}-1-dead{i:02d}.jsonl.gz"
+            path.write_bytes(gzip.compress(b''))
+            os.utime(path, (stale + i, stale + i))
+        other_live = directory / 'trace-20200101-000009-2-live00.jsonl.gz'
+        other_live.write_bytes(gzip.compress(b''))
+        os.utime(other_live, (stale + 10, time.time() - 5))
+
+        # Cap of 1: only our own new file is within it, the live worker's file is spared anyway
+        writer = traffic_capture._TraceWriter(directory, 1024, max_files=1)
+        writer.submit({"id": "new"})
+        writer.close()
+        left = sorted(p.name for p in directory.iterdir())
+        assert len(left) == 2 and other_live.name in left, left
+        assert not [name for name in left if '-dead' in name], left
+    finally:
+        shutil.rmtree(directory)
+    print("✅ pruning keeps the newest files and anything a live worker is writing")
+
+
+if __name__ == "__main__":
+    print("\n🚀 Traffic capture tests\n")
+    test_capture_and_replay_round_trip()
+    test_replayed_connection_failure_raises()
+    test_truncated_traces_are_readable()
+    test_pruning_spares_live_workers()
+    print("\n✨ Tests complete!\n")
@@ -0,0 +1,344 @@
+"""
+Opt-in capture of production traffic for offline, deterministic replay.
+
+When TRACE_CAPTURE=1, every /orchestrate and /draft-reply request is recorded
+together with the upstream LLM responses it triggered and per-stage timings.
+Records are handed to a background writer thread and written as gzip'd JSON
+lines to TRACE_DIR, rotated by compressed size and count, so the request path
+only pays for building a small dict. TRACE_MAX_FILES caps the whole directory:
+older files are pruned unless another live worker may still be writing them,
+which each writer signals by touching its open file every minute.
+
+Records hold full request bodies (email text, chat history, student
+questions) in plaintext; treat TRACE_DIR as sensitive.
+
+When TRACE_REPLAY points at a trace file or directory, upstream calls tagged
+with the X-Trace-Replay-Id header are answered from the recorded responses
+instead of the network. See replay_traces.py for the client side.
+
+Record format (one JSON object per line):
+    {"id", "ts", "endpoint", "request", "upstream": [{"url", "status", "body", "latency_ms"}],
+     "stages": {name: ms}, "response", "duration_ms"}
+"""
+from typing import Any, Dict, Iterator, List, Optional
+import atexit
+import contextlib
+import contextvars
+import gzip
+import json
+import os
+import pathlib
+import queue
+import random
+import threading
+import time
+import uuid
+import zlib
+import requests
+
+REPLAY_HEADER = 'X-Trace-Replay-Id'
+
+TRACE_CAPTURE = os.environ.get('TRACE_CAPTURE', '0') == '1'
+TRACE_DIR = pathlib.Path(os.environ.get('TRACE_DIR', pathlib.Path(__file__).resolve().parent / 'traces'))
+TRACE_SAMPLE_RATE = float(os.environ.get('TRACE_SAMPLE_RATE', '1.0'))
+# TRACE_MAX_BYTES is measured on the compressed file; TRACE_MAX_FILES covers all workers
+TRACE_MAX_BYTES = int(os.environ.get('TRACE_MAX_BYTES', 16 * 1024 * 1024))
+TRACE_MAX_FILES = int(os.environ.get('TRACE_MAX_FILES', 20))
+TRACE_REPLAY = os.environ.get('TRACE_REPLAY', '')
+# Sleep for the recorded upstream latency when serving replayed responses
+TRACE_REPLAY_LATENCY = os.environ.get('TRACE_REPLAY_LATENCY', '1') == '1'
+
+# Open trace files are touched this often; files untouched for _TRACE_STALE_SECONDS belong to dead processes
+_TRACE_HEARTBEAT_SECONDS = 60
+_TRACE_STALE_SECONDS = 5 * _TRACE_HEARTBEAT_SECONDS
+
+_inflight = 0
+_inflight_lock = threading.Lock()
+
+_current: contextvars.ContextVar[Optional[Dict[str, Any]]] = contextvars.ContextVar('trace_record', default=None)
+_replay: contextvars.ContextVar[Optional[List[Dict[str, Any]]]] = contextvars.ContextVar('trace_replay', default=None)
+
+
+class _TraceWriter:
+    """Background thread that writes records to rotated, gzip'd JSONL files."""
+
+    def __init__(self, directory: pathlib.Path, max_bytes: int, max_files: int):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.max_files = max_files
+        self.queue: "queue.Queue[Optional[Dict[str, Any]]]" = queue.Queue(maxsize=10000)
+        self.dropped = 0
+        self._file = None
+        self._path: Optional[pathlib.Path] = None
+        self._own: set = set()
+        self._thread = threading.Thread(target=self._run, name='trace-writer', daemon=True)
+        self._thread.start()
+        atexit.register(self.close)
+
+    def submit(self, record: Dict[str, Any]) -> None:
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            # Never block a request on tracing
+            self.dropped += 1
+
+    def close(self) -> None:
+        self.queue.put(None)
+        self._thread.join(timeout=5)
+
+    def _open(self) -> None:
+        self.directory.mkdir(parents=True, exist_ok=True)
+        name = f"trace-{time.strftime('%Y%m%d-%H%M%S')}-{os.getpid()}-{uuid.uuid4().hex[:6]}.jsonl.gz"
+        self._path = self.directory / name
+        self._file = gzip.open(self._path, 'wb')
+        self._own.add(self._path)
+        self._prune()
+
+    def _prune(self) -> None:
+        """Keep the newest max_files traces, plus any file another live worker may still be writing."""
+        now = time.time()
+        files = []
+        for path in self.directory.glob('trace-*.jsonl.gz'):
+            try:
+                files.append((path.stat().st_mtime, path))
+            except OSError:
+                continue  # pruned by another worker meanwhile
+        files.sort(reverse=True)
+        for mtime, path in files[max(self.max_files, 1):]:
+            if path == self._path or (path not in self._own and now - mtime < _TRACE_STALE_SECONDS):
+                continue
+            try:
+                path.unlink()
+            except OSError:
+                pass
+            self._own.discard(path)
+
+    def _heartbeat(self) -> None:
+        if self._path is not None:
+            try:
+                os.utime(self._path)
+            except OSError:
+                pass
+
+    def _run(self) -> None:
+        while True:
+            try:
+                record = self.queue.get(timeout=_TRACE_HEARTBEAT_SECONDS)
+            except queue.Empty:
+                # Idle: keep the open file fresh so other workers don't prune it
+                self._heartbeat()
+                continue
+            if record is None:
+                break
+            try:
+                if self._file is None or self._file.fileobj.tell() >= self.max_bytes:
+                    if self._file is not None:
+                        self._file.close()
+                    self._open()
+                line = (json.dumps(record, default=str) + '\n').encode('utf-8')
+                self._file.write(line)
+                if self.queue.empty():
+                    # Sync flush so a crashed process still leaves readable traces
+                    self._file.flush()
+            except Exception as e:
+                print(f"[ERROR] Trace write failed: {e}")
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+
+_writer: Optional[_TraceWriter] = None
+_writer_lock = threading.Lock()
+
+
+def _get_writer() -> _TraceWriter:
+    global _writer
+    if _writer is None:
+        with _writer_lock:
+            if _writer is None:
+                _writer = _TraceWriter(TRACE_DIR, TRACE_MAX_BYTES, TRACE_MAX_FILES)
+                print(f"[DEBUG] Trace capture enabled, writing to {TRACE_DIR}")
+    return _writer
+
+
+def read_traces(path: str) -> Iterator[Dict[str, Any]]:
+    """
+    Yield records from a trace file or every trace file in a directory, oldest
+    first. Files cut off mid-write (crash, or still being written) yield the
+    records that were flushed.
+    """
+    p = pathlib.Path(path)
+    files = sorted(p.glob('*.jsonl.gz'), key=lambda f: f.stat().st_mtime) if p.is_dir() else [p]
+    for f in files:
+        opener = gzip.open if f.suffix == '.gz' else open
+        try:
+            with opener(f, 'rt', encoding='utf-8') as fh:
+                for line in fh:
+                    line = line.strip()
+                    if not line:
+                        continue
+                    try:
+                        record = json.loads(line)
+                    except json.JSONDecodeError:
+                        # Partial last line of a truncated file
+                        print(f"[DEBUG] Skipping unreadable trace line in {f.name}")
+                        continue
+                    yield record
+        except (EOFError, zlib.error, gzip.BadGzipFile) as e:
+            # No gzip trailer yet, or the file was cut off mid-block; keep what was readable
+            print(f"[DEBUG] Trace file {f.name} is truncated ({type(e).__name__}), using the records before it")
+            continue
+
+
+_replay_index: Optional[Dict[str, List[Dict[str, Any]]]] = None
+
+
+def _get_replay_index() -> Dict[str, List[Dict[str, Any]]]:
+    global _replay_index
+    if _replay_index is None:
+        with _writer_lock:
+            if _replay_index is None:
+                _replay_index = {r['id']: r.get('upstream', []) for r in read_traces(TRACE_REPLAY)}
+                print(f"[DEBUG] Loaded {len(_replay_index)} trace records for replay from {TRACE_REPLAY}")
+    return _replay_index
+
+
+@contextlib.contextmanager
+def capture(endpoint: str, request_body: Dict[str, Any], replay_id: Optional[str] = None) -> Iterator[Optional[Dict[str, Any]]]:
+    """
+    Wrap the handling of one request. Yields the live record (or None when not
+    capturing) so the caller can attach the response with record['response'] = ...
+    """
+    replay_token = None
+    if TRACE_REPLAY and replay_id:
+        upstream = _get_replay_index().get(replay_id)
+        if upstream is None:
+            print(f"[DEBUG] No recorded upstream responses for replay id {replay_id}")
+        # Copy so repeated replays of the same id start from the first response
+        replay_token = _replay.set(list(upstream or []))
+
+    if not TRACE_CAPTURE or random.random() >= TRACE_SAMPLE_RATE:
+        try:
+            yield None
+        finally:
+            if replay_token is not None:
+                _replay.reset(replay_token)
+        return
+
+    record: Dict[str, Any] = {
+        "id": uuid.uuid4().hex,
+        "ts": time.time(),
+        "endpoint": endpoint,
+        "request": request_body,
+        "upstream": [],
+        "stages": {},
+    }
+    token = _current.set(record)
+    start = time.perf_counter()
+    try:
+        yield record
+    finally:
+        record["duration_ms"] = round((time.perf_counter() - start) * 1000, 3)
+        _current.reset(token)
+        if replay_token is not None:
+            _replay.reset(replay_token)
+        _get_writer().submit(record)
+
+
+@contextlib.contextmanager
+def stage(name: str) -> Iterator[None]:
+    """Time a named stage of the current request; free when nothing is being captured."""
+    record = _current.get()
+    if record is None:
+        yield
+        return
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        stages = record["stages"]
+        stages[name] = round(stages.get(name, 0.0) + (time.perf_counter() - start) * 1000, 3)
+
+
+class _ReplayResponse:
+    """Just enough of requests.Response for the upstream call sites."""
+
+    def __init__(self, url: str, status_code: int, text: str):
+        self.url = url
+        self.status_code = status_code
+        self.text = text
+
+    def json(self) -> Any:
+        return json.loads(self.text)
+
+    def raise_for_status(self) -> None:
+        if self.status_code >= 400:
+            raise requests.HTTPError(f"{self.status_code} Error (replayed) for url: {self.url}", response=self)
+
+
+def upstream_inflight() -> int:
+    """Number of upstream calls currently waiting on the network."""
+    return _inflight
+
+
+@contextlib.contextmanager
+def _track_inflight() -> Iterator[None]:
+    global _inflight
+    with _inflight_lock:
+        _inflight += 1
+    try:
+        yield
+    finally:
+        with _inflight_lock:
+            _inflight -= 1
+
+
+def replaying() -> bool:
+    """True while handling a request whose upstream responses come from a trace."""
+    return _replay.get() is not None
+
+
+def record_upstream(url: str, status: int, body: str, latency_ms: float) -> None:
+    """Attach an upstream response to the current record (no-op when not capturing)."""
+    record = _current.get()
+    if record is None:
+        return
+    latency = round(latency_ms, 3)
+    record["upstream"].append({"url": url, "status": status, "body": body, "latency_ms": latency})
+    record["stages"]["upstream"] = round(record["stages"].get("upstream", 0.0) + latency, 3)
+
+
+def upstream_post(url: str, json: Dict[str, Any], headers: Dict[str, str], timeout: float, record: bool = True):
+    """
+    POST to the upstream LLM endpoint. Records the response when capturing and
+    serves it from the trace when replaying. Pass record=False when the caller
+    records a per-request view of the response itself (e.g. batched calls).
+    """
+    replayed = _replay.get()
+    if replayed is not None:
+        if not replayed:
+            raise RuntimeError("Replay has no recorded upstream response for this call")
+        entry = replayed.pop(0)
+        if TRACE_REPLAY_LATENCY and entry.get('latency_ms'):
+            time.sleep(entry['latency_ms'] / 1000)
+        if not entry.get('status'):
+            # The original call failed before getting a response
+            raise requests.ConnectionError(f"Replayed upstream failure: {entry.get('body', '')}")
+        return _ReplayResponse(entry.get('url', url), entry.get('status', 200), entry.get('body', ''))
+
+    if not record or _current.get() is None:
+        with _track_inflight():
+            return requests.post(url, json=json, headers=headers, timeout=timeout)
+
+    start = time.perf_counter()
+    status, body = 0, ''
+    try:
+        with _track_inflight():
+            resp = requests.post(url, json=json, headers=headers, timeout=timeout)
+        status, body = resp.status_code, resp.text
+        return resp
+    except Exception as e:
+        body = f"{type(e).__name__}: {e}"
+        raise
+    finally:
+        record_upstream(url, status, body, (time.perf_counter() - start) * 1000)
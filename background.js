@@ -14,6 +14,16 @@ chrome.action.onClicked.addListener((tab) => {
   });
 });
 
+// Stable per-install id, sent as X-Client-Id so the backend can tell students
+// apart behind a shared proxy (used to learn which question follows which)
+function getClientId() {
+  return chrome.storage.local.get('clientId').then(({ clientId }) => {
+    if (clientId) return clientId;
+    const id = crypto.randomUUID();
+    return chrome.storage.local.set({ clientId: id }).then(() => id);
+  });
+}
+
 // Handle messages from content script (orchestration requests and email replies)
 chrome.runtime.onMessage.addListener((msg, sender, sendResponse) => {
   if (!msg) return;
@@ -23,11 +33,12 @@ chrome.runtime.onMessage.addListener((msg, sender, sendResponse) => {
     
     const url = 'http://127.0.0.1:8000/orchestrate';
     
-    fetch(url, {
-      method: 'POST',
-      headers: { 'Content-Type': 'application/json' },
-      body: JSON.stringify({ message: msg.message })
-    })
+    getClientId()
+      .then(clientId => fetch(url, {
+        method: 'POST',
+        headers: { 'Content-Type': 'application/json', 'X-Client-Id': clientId },
+        body: JSON.stringify({ message: msg.message })
+      }))
       .then(async response => {
         if (!response.ok) {
           const text = await response.text().catch(() => '');
@@ -50,26 +61,20 @@ chrome.runtime.onMessage.addListener((msg, sender, sendResponse) => {
   if (msg.type === 'draft_reply') {
     console.log('[Background] Email reply request:', msg.emailText.substring(0, 100));
     
-    const url = 'http://127.0.0.1:8000/draft-reply';
-    
-    fetch(url, {
-      method: 'POST',
-      headers: { 'Content-Type': 'application/json' },
-      body: JSON.stringify({ 
-        emailText: msg.emailText,
-        userInstructions: msg.userInstructions || ''
-      })
-    })
-      .then(async response => {
-        if (!response.ok) {
-          const text = await response.text().catch(() => '');
-          throw new Error(`${response.status} ${response.statusText}: ${text}`);
-        }
-        return response.json();
-      })
-      .then(data => {
+    // Job mode: the POST returns immediately and we long-poll for the result. Each
+    // poll is still an open request of up to 20 s, so the worker can be suspended
+    // mid-job; the job id is kept in chrome.storage.session and a retry of the same
+    // draft (or the restarted worker, see resumeDraftJobs) picks the job back up.
+    draftJobKey(msg.emailText, msg.userInstructions || '')
+      .then(key => chrome.storage.session.get(key).then(stored => {
+        const entry = stored[key];
+        if (entry && entry.reply) return entry.reply;
+        const resume = entry ? pollDraftJob(key, entry.jobId) : Promise.resolve(null);
+        return resume.then(reply => reply !== null ? reply : submitDraftJob(key, msg.emailText, msg.userInstructions || ''));
+      }))
+      .then(reply => {
         console.log('[Background] Reply generated');
-        sendResponse({ reply: data.reply });
+        sendResponse({ reply: reply });
       })
       .catch(err => {
         console.error('[Background] Reply error:', err);
@@ -78,4 +83,73 @@ chrome.runtime.onMessage.addListener((msg, sender, sendResponse) => {
     
     return true; // async response
   }
-});
\ No newline at end of file
+});
+
+const DRAFT_JOBS_URL = 'http://127.0.0.1:8000/draft-reply/jobs';
+
+// Storage key for a draft: the backend dedupes on the same email and instructions
+function draftJobKey(emailText, userInstructions) {
+  const data = new TextEncoder().encode(`${emailText}\n${userInstructions}`);
+  return crypto.subtle.digest('SHA-256', data).then(digest =>
+    'draftJob:' + Array.from(new Uint8Array(digest), b => b.toString(16).padStart(2, '0')).join(''));
+}
+
+async function checkResponse(response) {
+  if (!response.ok) {
+    const text = await response.text().catch(() => '');
+    throw new Error(`${response.status} ${response.statusText}: ${text}`);
+  }
+  return response.json();
+}
+
+function submitDraftJob(key, emailText, userInstructions) {
+  return fetch(DRAFT_JOBS_URL, {
+    method: 'POST',
+    headers: { 'Content-Type': 'application/json' },
+    body: JSON.stringify({ emailText: emailText, userInstructions: userInstructions })
+  })
+    .then(checkResponse)
+    .then(job => chrome.storage.session.set({ [key]: { jobId: job.job_id } })
+      .then(() => waitForDraftJob(key, job)));
+}
+
+// Resolve with the reply, or null if the backend no longer knows the job (restarted
+// or expired) so the caller can submit it again
+function pollDraftJob(key, jobId) {
+  return fetch(`${DRAFT_JOBS_URL}/${jobId}?wait=20`).then(response => {
+    if (response.status === 404) return chrome.storage.session.remove(key).then(() => null);
+    return checkResponse(response).then(job => waitForDraftJob(key, job));
+  });
+}
+
+function waitForDraftJob(key, job) {
+  if (job.status === 'done') return chrome.storage.session.remove(key).then(() => job.reply);
+  if (job.status === 'failed') {
+    return chrome.storage.session.remove(key).then(() => {
+      throw new Error(job.error || 'Draft job failed');
+    });
+  }
+  return pollDraftJob(key, job.job_id);
+}
+
+// On worker start, keep polling jobs a suspended worker left behind and hold on to
+// their replies until the content script asks for the same draft again
+function resumeDraftJobs() {
+  chrome.storage.session.get(null).then(stored => {
+    Object.entries(stored)
+      .filter(([key, entry]) => key.startsWith('draftJob:') && entry.jobId && !entry.reply)
+      .forEach(([key, entry]) => {
+        console.log('[Background] Resuming draft job:', entry.jobId);
+        fetch(`${DRAFT_JOBS_URL}/${entry.jobId}?wait=20`)
+          .then(response => response.status === 404 ? null : checkResponse(response))
+          .then(function follow(job) {
+            if (!job || job.status === 'failed') return chrome.storage.session.remove(key);
+            if (job.status === 'done') return chrome.storage.session.set({ [key]: { jobId: job.job_id, reply: job.reply } });
+            return fetch(`${DRAFT_JOBS_URL}/${job.job_id}?wait=20`).then(checkResponse).then(follow);
+          })
+          .catch(err => console.error('[Background] Resume error:', err));
+      });
+  });
+}
+
+resumeDraftJobs();